@@ -2,11 +2,20 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import Input, Output, State, callback, dcc, html, set_props
 from demo.src.about import tt_description
-from demo.src.timetables import CONTRACT_TYPES
+from demo.src.jobs import JobManager
+from demo.src.spots import get_store
+from demo.src.timetables import CONTRACT_TYPES, TICKERS, contract_terms
 
+# Load the spot history once, before gunicorn (with --preload) forks the workers.
+get_store()
 
+
+# The heavy callbacks of the pages run as background jobs, see demo.src.jobs.
 app = dash.Dash(
-    __name__, use_pages=True, external_stylesheets=[dbc.themes.SOLAR]
+    __name__,
+    use_pages=True,
+    external_stylesheets=[dbc.themes.SOLAR],
+    background_callback_manager=JobManager(),
 )
 server = app.server
 
@@ -54,7 +63,7 @@ FLOOR_CAP_STYLE = {
 contract_editor = html.Div(
     [
         dcc.Dropdown(
-            ["SPX", "EUR", "BTC", "FTSE"],
+            TICKERS,
             "SPX",
             id="ctr-ticker",
         ),
@@ -236,7 +245,9 @@ def update_editor(contract_type):
     Input("ctr-floor-cap", "value"),
 )
 def update_graph(ticker, contract_type, option_type, strike, floor_cap):
-    """Collect parameters from the contract editor and store them in a dict."""
+    """Collect parameters from the contract editor and store them in a dict, with
+    only those used by the contract type, so that e.g. moving the strike slider of a
+    cliquet does not price it again."""
 
     contract_params = {
         "ticker": ticker,
@@ -246,7 +257,7 @@ def update_graph(ticker, contract_type, option_type, strike, floor_cap):
         "floor_cap": floor_cap,
     }
 
-    return contract_params
+    return contract_terms(contract_params)
 
 
 # Toggle the offcanvas to show the contract description.
@@ -0,0 +1,93 @@
+/*
+Clientside version of plot_cashflow (demo/src/plots/backtest_plots.py).
+Draws the cashflow of the hovered trade from the data sent once with the IRR plot
+(see cashflow_figure_data), so that hovering never calls the server.
+*/
+
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    past: {
+        plot_cashflow: function (hoverData, data) {
+            const no_update = window.dash_clientside.no_update;
+            if (!hoverData || !data) {
+                return no_update;
+            }
+            const idx = hoverData.points[0].customdata;
+            if (idx === undefined || idx === null || !data.stats[idx]) {
+                return no_update;
+            }
+
+            const [prcTs, endTs] = data.dates[idx];
+            const [cfTs, cfs, tradePrice] = data.stats[idx];
+            const fmt = (ts) => new Date(ts).toISOString().slice(0, 10);
+
+            // Cashflow bars, starting with the trade price on the trade date
+            const x = [prcTs].concat(cfTs);
+            const y = [-tradePrice].concat(cfs);
+            const color = y.map((v) => (v < 0 ? "coral" : "aquamarine"));
+
+            // The ticker between the trade date and maturity
+            const spotX = [];
+            const spotY = [];
+            data.spot_ts.forEach((ts, i) => {
+                if (ts >= prcTs && ts <= endTs) {
+                    spotX.push(ts);
+                    spotY.push(data.spot[i]);
+                }
+            });
+            const startSpot = spotY[0];
+            const endSpot = spotY[spotY.length - 1];
+
+            const layout = JSON.parse(JSON.stringify(data.layout));
+            layout.xaxis.type = "date";
+            layout.xaxis2.type = "date";
+            layout.yaxis2.tickvals = [startSpot];
+            layout.annotations = [
+                {x: prcTs, text: `Trade Date<br><b>${fmt(prcTs)}</b>`},
+                {x: endTs, text: `Maturity<br><b>${fmt(endTs)}</b>`},
+                {
+                    x: prcTs,
+                    y: startSpot,
+                    xref: "x2",
+                    yref: "y2",
+                    text: `${startSpot}`,
+                    showarrow: false,
+                    xanchor: "right",
+                    font: {color: "dimgrey"},
+                },
+                {
+                    x: endTs,
+                    y: endSpot,
+                    xref: "x2",
+                    yref: "y2",
+                    text: `${endSpot}`,
+                    showarrow: false,
+                    xanchor: "left",
+                    font: {color: "dimgrey"},
+                },
+            ];
+
+            return {
+                data: [
+                    {
+                        type: "bar",
+                        x: x,
+                        y: y,
+                        width: data.bar_width,
+                        marker: {color: color},
+                        xaxis: "x",
+                        yaxis: "y",
+                    },
+                    {
+                        type: "scatter",
+                        x: spotX,
+                        y: spotY,
+                        line: {color: "dimgrey", width: 1},
+                        xaxis: "x2",
+                        yaxis: "y2",
+                    },
+                ],
+                layout: layout,
+            };
+        },
+    },
+});
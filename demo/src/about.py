@@ -2,30 +2,21 @@
 Write about the contract in markdown.
 """
 
-from demo.src.model import DataModel
-from demo.src.timetables import create_timetable
+from demo.src.cache import cached
+from demo.src.context import pricing_context
 
 
+@cached()
 def tt_description(contract_params: dict, trial=0):
-    # Create Contract
-    csvdata = DataModel()
-
-    # get all month ends
-    monthend_datetimes = csvdata.monthend_datetimes(contract_params["ticker"])
-
-    pricing_datetime = monthend_datetimes[trial]  # timestamp of trading date
-
-    spot = csvdata.get_value(contract_params["ticker"], pricing_datetime)
-
-    contract = create_timetable(
-        monthend_datetimes, spot, trial, contract_params
-    )
+    # Contract, shared with the pricings of the future page
+    ctx = pricing_context(contract_params, trial)
+    contract = ctx.contract
 
     # Get Definition Text from Contract docstring
     defn_text = contract.__doc__.split("\n\n")[0]
 
     # Create Timetable Text
-    timetable = contract.timetable()
+    timetable = ctx.timetable()
     df = timetable["events"].to_pandas()
     df["time"] = df["time"].dt.strftime(
         "%m/%d/%Y"
@@ -2,77 +2,248 @@
 Method to run backtest for a given contract.
 """
 
+import functools
+import json
+import os
+from functools import partial
+from itertools import islice
+
+import numpy as np
 import pandas as pd
-from finmc.models.localvol import LVMC
-from qablet.base.mc import MCPricer
 
-from demo.src.model import CFModelPyCSV, DataModel, get_cf
-from demo.src.timetables import create_timetable
-from demo.src.utils import base_dataset, compute_return, dataset_assets
+from demo.src.cache import cached
+from demo.src.mc import CachedLVMC, adaptive_price
+from demo.src.model import CFModelPyCSV, DataModel, get_cf, get_cfs
+from demo.src.replay import replay
+from demo.src.spots import SPOTS_FILE
+from demo.src.timetables import create_timetables
+from demo.src.utils import (
+    base_dataset,
+    dataset_assets,
+    flat_returns,
+    get_executor,
+)
+
+# Number of processes for the backtest, 1 runs the trials serially.
+BACKTEST_WORKERS = int(os.environ.get("BACKTEST_WORKERS", "1"))
+
+
+@functools.lru_cache(maxsize=16)
+def backtest_batch(params_key: str):
+    """Return the TimetableBatch of the contract traded on each trade date of the
+    backtest, for the contract parameters (as canonical json). The batch is built
+    once per process, and shared by the trials priced there."""
+    contract_params = json.loads(params_key)
+    csvdata = DataModel(SPOTS_FILE)
+    ticker = contract_params["ticker"]
+    monthend_datetimes = csvdata.monthend_datetimes(ticker)
+
+    m_exp = 12
+    trials = np.arange(max(len(monthend_datetimes) - m_exp, 0))
+    spots = [csvdata.get_value(ticker, monthend_datetimes[i]) for i in trials]
+    return create_timetables(
+        monthend_datetimes, spots, trials, contract_params
+    )
+
+
+def trial_timetable(contract_params: dict, trial: int):
+    """Return the trade date of a trial, its timestamp, the spot on that date, and
+    the timetable of the contract traded on that date, a slice of the batch."""
+    batch = backtest_batch(json.dumps(contract_params, sort_keys=True))
+    pricing_datetime = batch.monthend_datetimes[trial]
+    pricing_ts = int(pricing_datetime.timestamp() * 1000)
+    spot = batch.spots[trial]
+    return pricing_datetime, pricing_ts, spot, batch.timetable(trial)
 
 
-def run_backtest(contract_params: dict, annualized: bool = True):
+def price_trial(contract_params: dict, trial: int):
     """
-    Run backtest for a given contract. The backtest is run on a historical dataset.
-    Return the a dataframe with IRR for each trade date,
-    and a dict with the cashflow for each trade date.
+    Price the contract on one trade date (trial).
+    Each trial starts from base_dataset, with its own copy of the MC settings, so the
+    random numbers of a trial do not depend on which process runs it, or in what order.
+    Return the price, and the (standard error, paths) of the price.
     """
-    # Create the models
-    filename = "demo/data/spots.csv"
-    csvdata = DataModel(filename)
-    model = MCPricer(LVMC)
-    bk_model = CFModelPyCSV(filename=filename, base="USD")
+    _, pricing_ts, spot, timetable = trial_timetable(contract_params, trial)
 
     # Use current divs and risk free for historical pricings
     dataset = base_dataset()
+    dataset["PRICING_TS"] = pricing_ts
+    dataset["ASSETS"] = dataset_assets(spot, contract_params)
+    dataset["LV"] = {"ASSET": contract_params["ticker"], "VOL": 0.3}
 
-    results = []
-    all_stats = []
-    all_ts = []
+    # Compute prices of 0 and unit coupon
+    px, mc_stats = adaptive_price(CachedLVMC, timetable, dataset)
+    return px, (mc_stats["SE"], mc_stats["PATHS"])
 
-    # Fetch adjusted month-end dates using the monthend_datetimes method
-    ticker = contract_params["ticker"]
-    monthend_datetimes = csvdata.monthend_datetimes(ticker)
 
-    m_exp = 12
-    num_trials = len(monthend_datetimes) - m_exp
-    for i in range(num_trials):
-        pricing_datetime = monthend_datetimes[i]
-        pricing_ts = int(pricing_datetime.timestamp() * 1000)
-        spot = csvdata.get_value(ticker, pricing_datetime)
-
-        dataset["PRICING_TS"] = pricing_ts
-        dataset["ASSETS"] = dataset_assets(spot, contract_params)
-        dataset["LV"] = {"ASSET": ticker, "VOL": 0.3}
-
-        timetable = create_timetable(
-            monthend_datetimes, spot, i, contract_params
-        ).timetable()
-
-        # Compute prices of 0 and unit coupon
-        px, _ = model.price(timetable, dataset)
-
-        # Compute backtest stats and irr
-        stats = bk_model.cashflow(timetable)
-        yrs_vec, cf_vec, ts_vec = get_cf(pricing_ts, timetable, stats)
-        irr = compute_return(cf_vec, yrs_vec, px, annualized=annualized)
-
-        results.append((pricing_datetime, irr))
-        all_stats.append(
-            (ts_vec.astype("uint64").tolist(), cf_vec.tolist(), px)
+def backtest_trial(contract_params: dict, trial: int):
+    """
+    Price the contract on one trade date (trial), and replay it on the historical data,
+    with the qablet cashflow model. run_backtest replays all the trials at once, and
+    this is the reference for a single trial.
+    Return the trade date, the cashflow years, amounts and timestamps, the price,
+    the (trade, maturity) timestamps, and the (standard error, paths) of the price.
+    """
+    pricing_datetime, pricing_ts, _, timetable = trial_timetable(
+        contract_params, trial
+    )
+    px, mc_stats = price_trial(contract_params, trial)
+
+    # Compute backtest stats
+    bk_model = CFModelPyCSV(filename=SPOTS_FILE, base="USD")
+    stats = bk_model.cashflow(timetable)
+    yrs_vec, cf_vec, ts_vec = get_cf(pricing_ts, timetable, stats)
+
+    end_ts = int(timetable["events"]["time"][-1].as_py().timestamp() * 1000)
+    return (
+        pricing_datetime,
+        yrs_vec,
+        cf_vec,
+        ts_vec,
+        px,
+        (pricing_ts, end_ts),
+        mc_stats,
+    )
+
+
+def is_annualized(contract_params):
+    """Show annualized returns for the notes, and gain/loss for the others."""
+    return contract_params["ctr-type"] in [
+        "Discount Certificate",
+        "Reverse Convertible",
+    ]
+
+
+def stream_backtest(
+    contract_params: dict,
+    annualized: bool = True,
+    workers=None,
+    on_priced=None,
+):
+    """
+    Run the backtest of run_backtest, yielding the result of each trade date (trial)
+    as soon as it is priced, in order of trade date. Each result is a dict with the
+    trade date, irr, converged, price, price_se and paths, the cashflow timestamps
+    (ts) and amounts (cf), and the (trade, maturity) timestamps.
+    The cashflows of all the trials are replayed first, since they do not depend on
+    the prices. The irr are solved for the trials priced since the last batch, a
+    tenth of the trials at most. If given, on_priced(count) is called as each trial
+    is priced, with the number of trials priced so far, before its irr is solved.
+    """
+    if workers is None:
+        workers = BACKTEST_WORKERS
+
+    # The trade dates, and the timetables of all trials in one batch
+    batch = backtest_batch(json.dumps(contract_params, sort_keys=True))
+    num_trials = len(batch)
+
+    # Replay the timetables of all trials on the historical data
+    expressions = [batch.expressions(i) for i in range(num_trials)]
+    cashflows = replay(batch.table(), expressions)
+
+    # Net the cashflows of all trials by date, at once
+    dates = [batch.monthend_datetimes[trial] for trial in batch.trials]
+    pricing_ts = np.array([int(dt.timestamp() * 1000) for dt in dates])
+    times = batch.events["time"].cast("int64").to_numpy()
+    end_ts = times[batch.offsets[1:] - 1]
+    yrs, cfs, ts, offsets = get_cfs(
+        pricing_ts, times, batch.offsets, cashflows
+    )
+    ts = ts.astype("uint64")
+
+    run_trial = partial(price_trial, contract_params)
+    if workers > 1:
+        chunksize = max(1, num_trials // (4 * workers))
+        results = get_executor(workers).map(
+            run_trial, range(num_trials), chunksize=chunksize
         )
+    else:
+        results = map(run_trial, range(num_trials))
+
+    batch_size = max(1, num_trials // 10)
+    start = 0
+    while start < num_trials:
+        priced = []
+        for result in islice(results, batch_size):
+            priced.append(result)
+            if on_priced is not None:
+                on_priced(start + len(priced))
+        if not priced:
+            break
+        end = start + len(priced)
+        trials = range(start, end)
+        prices = [px for px, _ in priced]
 
-        end_ts = int(
-            timetable["events"]["time"][-1].as_py().timestamp() * 1000
+        # Solve for the irr of the trials priced in this batch
+        rows = slice(offsets[start], offsets[end])
+        irrs, converged = flat_returns(
+            cfs[rows],
+            yrs[rows],
+            offsets[start : end + 1] - offsets[start],
+            prices,
+            annualized=annualized,
         )
-        all_ts.append((pricing_ts, end_ts))
+        for k, (i, (px, (se, paths))) in enumerate(zip(trials, priced)):
+            yield {
+                "date": dates[i],
+                "irr": irrs[k],
+                "converged": converged[k],
+                "price": px,
+                "price_se": se,
+                "paths": paths,
+                "ts": ts[offsets[i] : offsets[i + 1]],
+                "cf": cfs[offsets[i] : offsets[i + 1]],
+                "dates": (int(pricing_ts[i]), int(end_ts[i])),
+            }
+        start += len(priced)
+
+
+@cached(ignore=("workers", "progress"))
+def run_backtest(
+    contract_params: dict, annualized: bool = True, workers=None, progress=None
+):
+    """
+    Run backtest for a given contract. The backtest is run on a historical dataset.
+    Return the a dataframe with IRR (and whether it converged), and the standard
+    error and number of paths of the price, for each trade date, and a dict with the
+    cashflow for each trade date.
+    The pricings are independent, and are fanned out over a pool of processes if
+    workers (default BACKTEST_WORKERS) is more than one. The results are the same.
+    The cashflows of all the trials are replayed at once, see demo.src.replay.
+    If given, progress(results, total, priced) is called as each trial is priced,
+    with the results of stream_backtest so far (solved by batch), the number of
+    trials and the number of trials priced.
+    """
+    total = len(backtest_batch(json.dumps(contract_params, sort_keys=True)))
+    results = []
+
+    def on_priced(count):
+        progress(results, total, count)
+
+    for result in stream_backtest(
+        contract_params,
+        annualized,
+        workers,
+        on_priced=None if progress is None else on_priced,
+    ):
+        results.append(result)
 
     df = pd.DataFrame(
-        results,
-        columns=["date", "irr"],
+        {
+            "date": [r["date"] for r in results],
+            "irr": np.array([r["irr"] for r in results], dtype=float),
+            "converged": np.array(
+                [r["converged"] for r in results], dtype=bool
+            ),
+            "price_se": [r["price_se"] for r in results],
+            "paths": [r["paths"] for r in results],
+        },
     )
+    all_stats = [
+        (r["ts"].tolist(), r["cf"].tolist(), r["price"]) for r in results
+    ]
     return df, {
         "stats": all_stats,
-        "ts": all_ts,
+        "ts": [r["dates"] for r in results],
         "ticker": contract_params["ticker"],
     }
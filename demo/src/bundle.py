@@ -0,0 +1,151 @@
+"""
+Precompute the results that the pages show, for the grid of contracts that the editor
+of the app can select, and write them to a bundle: a parquet file (compressed, by
+column) with a row per result, and the format version, code, spots and model
+fingerprints in its metadata. The app looks up the results in the bundle before it
+computes them (see demo.src.cache), so that most page views are a lookup.
+
+    python -m demo.src.bundle [--workers N] [--output FILE] [--floor-cap-step STEP]
+
+The bundle is used even with the result cache turned off (DEMO_CACHE=0), set
+DEMO_USE_BUNDLE=0 to compute every result instead.
+
+The cliquets are bundled on a grid of floor and cap (1% steps by default), the other
+floors and caps of the editor are computed when they are viewed.
+"""
+
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from demo.src.about import tt_description
+from demo.src.backtest import is_annualized, run_backtest
+from demo.src.cache import BUNDLE_FILE, bundle_metadata
+from demo.src.future_cf import COARSE_PATHS, vol_scenarios
+from demo.src.timetables import (
+    CONTRACT_TERMS,
+    CONTRACT_TYPES,
+    TICKERS,
+    contract_terms,
+)
+from demo.src.utils import get_executor
+
+# The grid of the contract editor
+STRIKES = range(80, 121)
+OPTION_TYPES = ["Call", "Put"]
+FLOOR_CAP_RANGE = (-10, 10)
+
+ROW_GROUP_ROWS = 64  # rows decompressed together, on a lookup
+
+
+def floor_cap_grid(step=1.0):
+    """Return the [floor, cap] pairs of the grid, with floor <= cap."""
+    lo, hi = FLOOR_CAP_RANGE
+    values = np.round(np.arange(lo, hi + step / 2, step), 1).tolist()
+    return [[f, c] for f in values for c in values if f <= c]
+
+
+def contract_grid(tickers=TICKERS, floor_cap_step=1.0):
+    """Return the contract parameters of the grid, as the app stores them (see
+    contract_terms), each contract once."""
+    terms = {
+        "strike": list(STRIKES),
+        "option_type": OPTION_TYPES,
+        "floor_cap": floor_cap_grid(floor_cap_step),
+    }
+    grid = []
+    for ticker in tickers:
+        for contract_type in CONTRACT_TYPES:
+            params = [{"ticker": ticker, "ctr-type": contract_type}]
+            for name in CONTRACT_TERMS[contract_type]:
+                params = [{**p, name: v} for p in params for v in terms[name]]
+            grid.extend(contract_terms(p) for p in params)
+    return grid
+
+
+def precompute(contract_params: dict):
+    """Compute the results of the pages for a contract, with the arguments of the
+    pages, but neither from nor into the result cache of this process.
+    Return a row (key, function, params, pickled result) for each result."""
+    calls = [
+        (run_backtest, {"annualized": is_annualized(contract_params)}),
+        (vol_scenarios, {"coarse_paths": COARSE_PATHS}),
+        (tt_description, {}),
+    ]
+    params = json.dumps(contract_params, sort_keys=True)
+    rows = []
+    for func, kwargs in calls:
+        result = func.__wrapped__(contract_params, **kwargs)
+        rows.append(
+            (
+                func.key(contract_params, **kwargs),
+                func.__name__,
+                params,
+                pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        )
+    return rows
+
+
+def write_bundle(rows, path=BUNDLE_FILE):
+    """Write the rows of precompute to a bundle, replacing the file at once."""
+    key, function, params, value = zip(*rows) if rows else ([],) * 4
+    table = pa.table(
+        {
+            "key": pa.array(key, pa.string()),
+            "function": pa.array(function, pa.string()),
+            "params": pa.array(params, pa.string()),
+            "value": pa.array(value, pa.binary()),
+        }
+    ).replace_schema_metadata(bundle_metadata())
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(
+        table,
+        tmp_path,
+        row_group_size=ROW_GROUP_ROWS,
+        compression="zstd",
+        use_dictionary=["function", "params"],
+    )
+    os.replace(tmp_path, path)
+    return table
+
+
+def build_bundle(
+    path=BUNDLE_FILE, workers=None, tickers=TICKERS, floor_cap_step=1.0
+):
+    """Precompute the results for the grid of contracts, in a pool of worker
+    processes (default: one per cpu), and write them to the bundle at path.
+    Return the number of contracts and the number of results."""
+    grid = contract_grid(tickers, floor_cap_step)
+    if workers == 1:
+        results = map(precompute, grid)
+    else:
+        executor = get_executor(workers)
+        results = executor.map(precompute, grid, chunksize=4)
+
+    rows = [row for contract_rows in results for row in contract_rows]
+    write_bundle(rows, path)
+    return len(grid), len(rows)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Precompute the results of the app into a bundle."
+    )
+    parser.add_argument("--output", default=BUNDLE_FILE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--tickers", nargs="+", default=TICKERS)
+    parser.add_argument("--floor-cap-step", type=float, default=1.0)
+    args = parser.parse_args()
+
+    contracts, results = build_bundle(
+        args.output, args.workers, args.tickers, args.floor_cap_step
+    )
+    print(f"{results} results of {contracts} contracts in {args.output}")
@@ -0,0 +1,355 @@
+"""
+Result cache for the heavy computations of the app. An in-process LRU sits in front of
+a size-bounded cache on disk, which is shared by all the worker processes. The key is a
+canonical hash of the function arguments (e.g. the contract parameters), the fingerprint
+of the spots data, the model settings from base_dataset, and the source code.
+Results missing from the cache are looked up in the bundle of precomputed results (see
+demo.src.bundle), if there is one, before they are computed.
+"""
+
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from demo.src.spots import get_store
+from demo.src.utils import ROOTDIR, base_dataset
+
+CACHE_DIR = os.environ.get("DEMO_CACHE_DIR", os.path.join(ROOTDIR, ".cache"))
+CACHE_MAX_ENTRIES = int(os.environ.get("DEMO_CACHE_ENTRIES", "128"))
+CACHE_MAX_BYTES = int(os.environ.get("DEMO_CACHE_MB", "256")) * 1024 * 1024
+
+# The bundle of precomputed results, and the version of its format. DEMO_CACHE=0
+# turns off the result cache only, DEMO_USE_BUNDLE=0 turns off the bundle.
+BUNDLE_FILE = os.environ.get(
+    "DEMO_BUNDLE", os.path.join(ROOTDIR, "data", "bundle.parquet")
+)
+BUNDLE_VERSION = 1
+
+
+def canonical_key(*parts) -> str:
+    """Return a hash of the parts, which must be json serializable. Dicts are
+    serialized with sorted keys, so the key does not depend on their order."""
+    text = json.dumps(
+        parts, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+@functools.cache
+def code_fingerprint() -> str:
+    """Return a hash of the source code of the demo, so that results computed by an
+    older version of the code are never served."""
+    digest = hashlib.sha256()
+    pattern = os.path.join(ROOTDIR, "src", "**", "*.py")
+    for path in sorted(glob.glob(pattern, recursive=True)):
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def nbytes(value) -> int:
+    """Return the size of a cached value, an array or bytes."""
+    return value.nbytes if hasattr(value, "nbytes") else len(value)
+
+
+class LRUCache:
+    """A thread-safe in-process cache, evicting the least recently used entries
+    beyond maxsize entries, or beyond max_bytes (if given) in total."""
+
+    def __init__(self, maxsize=CACHE_MAX_ENTRIES, max_bytes=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.data = OrderedDict()
+        self.lock = threading.Lock()
+        self.evictions = 0
+        self.size = 0
+
+    def get(self, key):
+        with self.lock:
+            value = self.data.get(key)
+            if value is not None:
+                self.data.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self.lock:
+            old = self.data.pop(key, None)
+            if old is not None:
+                self.size -= nbytes(old)
+            self.data[key] = value
+            self.size += nbytes(value)
+            while len(self.data) > self.maxsize or (
+                self.max_bytes is not None
+                and self.size > self.max_bytes
+                and len(self.data) > 1
+            ):
+                _, evicted = self.data.popitem(last=False)
+                self.size -= nbytes(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """A cache of bytes on disk, one file per key, evicting the least recently used
+    files when the directory grows beyond max_bytes. Files are written atomically,
+    so that concurrent readers in other processes never see a partial file."""
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES, suffix=".pkl"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.evictions = 0
+        self.size = (
+            None  # estimated size of the directory, scanned on first put
+        )
+
+    def path(self, key) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                value = f.read()
+            os.utime(path)  # mark as recently used
+        except OSError:
+            return None
+        return value
+
+    def put(self, key, value: bytes):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = self.path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+            if self.size is not None:
+                self.size += len(value)
+            if self.size is None or self.size > self.max_bytes:
+                self.evict()
+        except OSError:
+            pass  # e.g. a read-only deployment, the cache is only an optimization
+
+    def evict(self):
+        """Remove the least recently used files beyond max_bytes. The directory is
+        scanned only here, other processes may have added files since the last scan."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(self.suffix):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self.size = total
+
+    def clear(self):
+        for path in glob.glob(os.path.join(self.directory, "*" + self.suffix)):
+            os.remove(path)
+        self.size = None
+
+
+class ResultCache:
+    """A two level cache of python objects: an LRU in memory, and a cache on disk.
+    Values are kept pickled at both levels, so every hit returns a fresh copy that
+    the caller is free to modify."""
+
+    def __init__(self, directory, max_entries=CACHE_MAX_ENTRIES):
+        self.memory = LRUCache(max_entries)
+        self.disk = DiskCache(directory)
+        self.enabled = os.environ.get("DEMO_CACHE", "1") != "0"
+        self.lock = threading.Lock()  # for the counters
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def count(self, counter):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get(self, key):
+        """Return the cached value for the key, or None."""
+        value = self.memory.get(key)
+        if value is not None:
+            self.count("memory_hits")
+            return pickle.loads(value)
+        value = self.disk.get(key)
+        if value is not None:
+            self.count("disk_hits")
+            self.memory.put(key, value)
+            return pickle.loads(value)
+        self.count("misses")
+        return None
+
+    def put(self, key, value):
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self.memory.put(key, data)
+        self.disk.put(key, data)
+
+    def stats(self) -> dict:
+        """Return the hit, miss and eviction counters."""
+        with self.lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_evictions": self.memory.evictions,
+                "disk_evictions": self.disk.evictions,
+            }
+
+    def clear(self):
+        self.memory.clear()
+        self.disk.clear()
+
+
+RESULT_CACHE = ResultCache(os.path.join(CACHE_DIR, "results"))
+
+
+def bundle_metadata() -> dict:
+    """Return the metadata of a bundle built by the running code, a bundle with other
+    metadata holds no result that the cache keys can find."""
+    return {
+        "version": str(BUNDLE_VERSION),
+        "code": code_fingerprint(),
+        "spots": get_store().fingerprint,
+        "model": canonical_key(base_dataset()),
+    }
+
+
+class ResultBundle:
+    """A read-only bundle of precomputed results: a parquet file with the cache key,
+    the function, the contract parameters and the pickled result of each row (see
+    demo.src.bundle). The keys are read on first use, and the results of a row group
+    when one of them is needed. A missing, corrupt or stale bundle holds no
+    results."""
+
+    def __init__(self, path, max_groups=8):
+        self.path = path
+        self.file = None
+        self.index = None  # key -> (row group, row)
+        self.groups = LRUCache(max_groups)
+        self.lock = threading.Lock()
+        self.enabled = os.environ.get("DEMO_USE_BUNDLE", "1") != "0"
+        self.hits = 0
+
+    def load(self):
+        index = {}
+        try:
+            file = pq.ParquetFile(self.path, memory_map=True)
+            metadata = {
+                k.decode(): v.decode()
+                for k, v in (file.schema_arrow.metadata or {}).items()
+            }
+            if metadata == bundle_metadata():
+                for group in range(file.num_row_groups):
+                    keys = file.read_row_group(group, columns=["key"])["key"]
+                    for row, key in enumerate(keys.to_pylist()):
+                        index[key] = (group, row)
+        except (OSError, pa.ArrowException):
+            file, index = None, {}
+        self.file = file
+        self.index = index
+
+    def get(self, key):
+        """Return the result for the key, or None."""
+        data = self.get_data(key)
+        return None if data is None else pickle.loads(data)
+
+    def get_data(self, key):
+        """Return the pickled result for the key, or None."""
+        if not self.enabled:
+            return None
+        with self.lock:
+            if self.index is None:
+                self.load()
+            location = self.index.get(key)
+            if location is None:
+                return None
+            group, row = location
+            values = self.groups.get(group)
+            if values is None:
+                values = self.file.read_row_group(group, columns=["value"])
+                values = values["value"]
+                self.groups.put(group, values)
+            self.hits += 1
+        return values[row].as_py()
+
+
+RESULT_BUNDLE = ResultBundle(BUNDLE_FILE)
+
+
+def cached(cache=RESULT_CACHE, ignore=(), bundle=RESULT_BUNDLE):
+    """Decorator to cache the results of a function in a ResultCache. The key is built
+    from the function name and its arguments, except those named in ignore (such as
+    the number of workers, which does not change the results), together with the
+    spots fingerprint, the model settings and the code fingerprint.
+    A result missing from the cache (or any result, if the cache is disabled) is
+    looked up in the bundle before it is computed, and kept in the memory of the
+    cache, so that the next hits are not read from the bundle again.
+    The undecorated function is available as __wrapped__, and the key of the
+    arguments as key(*args, **kwargs)."""
+
+    def decorator(func):
+        signature = inspect.signature(func)
+        name = f"{func.__module__}.{func.__qualname__}"
+
+        def key(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = {
+                k: v for k, v in bound.arguments.items() if k not in ignore
+            }
+            return canonical_key(
+                name,
+                arguments,
+                get_store().fingerprint,
+                base_dataset(),
+                code_fingerprint(),
+            )
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            use_bundle = bundle is not None and bundle.enabled
+            if not cache.enabled and not use_bundle:
+                return func(*args, **kwargs)
+
+            result_key = key(*args, **kwargs)
+            result = cache.get(result_key) if cache.enabled else None
+            if result is None and use_bundle:
+                data = bundle.get_data(result_key)
+                if data is not None:
+                    if cache.enabled:
+                        cache.memory.put(result_key, data)
+                    result = pickle.loads(data)
+            if result is None:
+                result = func(*args, **kwargs)
+                if cache.enabled:
+                    cache.put(result_key, result)
+            return result
+
+        wrapper.cache = cache
+        wrapper.key = key
+        return wrapper
+
+    return decorator
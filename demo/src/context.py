@@ -0,0 +1,80 @@
+"""
+Pricing context of a contract traded on a trade date (trial): the spot data, the
+contract and its timetable, and the dataset to price it. The context is built once
+per process for each contract and trial, and shared by the pricings of the future
+page and the description of the contract.
+"""
+
+import functools
+import json
+
+from demo.src.model import DataModel
+from demo.src.timetables import (
+    create_forward_timetable,
+    create_timetable,
+    extend_timetable,
+)
+from demo.src.utils import base_dataset, dataset_assets
+
+
+class PricingContext:
+    """The contract of contract_params, traded on the date of the trial."""
+
+    def __init__(self, contract_params: dict, trial=0):
+        csvdata = DataModel()
+
+        self.params = contract_params
+        self.trial = trial
+        self.ticker = contract_params["ticker"]
+        self.monthend_datetimes = csvdata.monthend_datetimes(self.ticker)
+        self.pricing_datetime = self.monthend_datetimes[trial]
+        self.pricing_ts = int(self.pricing_datetime.timestamp() * 1000)
+        self.spot = csvdata.get_value(self.ticker, self.pricing_datetime)
+
+        self.contract = create_timetable(
+            self.monthend_datetimes, self.spot, trial, contract_params
+        )
+        self.assets = dataset_assets(self.spot, contract_params)
+        for _, data in self.assets.values():
+            data.flags.writeable = False  # shared by the datasets
+        self._timetable = self.contract.timetable()
+        self._forward_timetable = None
+
+    def timetable(self, forward=False) -> dict:
+        """Return the timetable of the contract, extended with a forward on the
+        ticker at maturity if forward is True. The events are shared, but the dict
+        is new, so the caller may extend it."""
+        if not forward:
+            return dict(self._timetable)
+        if self._forward_timetable is None:
+            timetable = dict(self._timetable)
+            end_dt = timetable["events"]["time"][-1].as_py()
+            extend_timetable(
+                timetable, create_forward_timetable(end_dt, self.params)
+            )
+            self._forward_timetable = timetable
+        return dict(self._forward_timetable)
+
+    def dataset(self, vol=None) -> dict:
+        """Return a new dataset to price the contract, from base_dataset, with the
+        local vol model on the ticker (vol added later if None, e.g. by a ladder).
+        The caller may change its MC settings, and replace its assets, whose data
+        is read-only since it is shared by all the datasets of the context."""
+        dataset = base_dataset()
+        dataset["PRICING_TS"] = self.pricing_ts
+        dataset["ASSETS"] = dict(self.assets)
+        dataset["LV"] = {"ASSET": self.ticker}
+        if vol is not None:
+            dataset["LV"]["VOL"] = vol
+        return dataset
+
+
+@functools.lru_cache(maxsize=32)
+def load_context(params_key: str, trial: int) -> PricingContext:
+    return PricingContext(json.loads(params_key), trial)
+
+
+def pricing_context(contract_params: dict, trial=0) -> PricingContext:
+    """Return the pricing context of the contract and trial, created once per
+    process for the same parameters (in any order)."""
+    return load_context(json.dumps(contract_params, sort_keys=True), trial)
@@ -2,53 +2,37 @@
 Project Future Cashflows for a given contract.
 """
 
-from finmc.models.localvol import LVMC
-from qablet.base.flags import Stats
-from qablet.base.mc import MCPricer
+import os
 
-from demo.src.model import DataModel
-from demo.src.timetables import (
-    create_forward_timetable,
-    create_timetable,
-    extend_timetable,
-)
-from demo.src.utils import base_dataset, dataset_assets
+from qablet.base.flags import Stats
 
+from demo.src.cache import cached
+from demo.src.context import pricing_context
+from demo.src.mc import CachedLVMC, adaptive_price, vol_ladder
 
-def model_cashflows(contract_params: dict, trial=0, vol=0.3):
-    # Create the models
-    csvdata = DataModel()
-    model = MCPricer(LVMC)
+# Default vols for the price vs vol plot
+VOL_GRID = [0.02, 0.05, 0.1, 0.2, 0.3]
 
-    ticker = contract_params["ticker"]
-    monthend_datetimes = csvdata.monthend_datetimes(ticker)
-    pricing_datetime = monthend_datetimes[trial]
-    pricing_ts = int(pricing_datetime.timestamp() * 1000)
-    spot = csvdata.get_value(ticker, pricing_datetime)
+# Paths per vol of the first estimate of the price vs vol plot, which is plotted with
+# its error bars, and then refined with the remaining paths. 0 prices all at once.
+COARSE_PATHS = int(os.environ.get("FUTURE_COARSE_PATHS", "1000"))
 
-    # prepare dataset
-    dataset = base_dataset()
 
-    dataset["PRICING_TS"] = pricing_ts
-    dataset["ASSETS"] = dataset_assets(spot, contract_params)
-    dataset["LV"] = {"ASSET": ticker, "VOL": vol}
+@cached()
+def model_cashflows(contract_params: dict, trial=0, vol=0.3):
+    ctx = pricing_context(contract_params, trial)
+    dataset = ctx.dataset(vol)
 
-    # create timetable for contract
-    timetable = create_timetable(
-        monthend_datetimes, spot, trial, contract_params
-    ).timetable()
+    # timetable for contract, extended with the forward timetable
+    timetable = ctx.timetable(forward=True)
 
-    # turn on cashflow flag
+    # turn on cashflow flag, with a fixed number of paths
     dataset["MC"]["FLAGS"] = Stats.CASHFLOW
     dataset["MC"]["PATHS"] = 100  # Too many dots otherwise
+    dataset["MC"].pop("TOL", None)
+    dataset["MC"].pop("BUDGET", None)
 
-    # create forward timetable
-    end_dt = timetable["events"]["time"][-1].as_py()
-    fwd_timetable = create_forward_timetable(end_dt, contract_params)
-
-    extend_timetable(timetable, fwd_timetable)
-
-    _, stats = model.price(timetable, dataset)
+    _, stats = adaptive_price(CachedLVMC, timetable, dataset)
 
     # Compute net cashflows for original timetable, and the forward timetable
     sums = []
@@ -58,37 +42,91 @@ def model_cashflows(contract_params: dict, trial=0, vol=0.3):
             sum = sum + v
         sums.append(sum)
 
-    return sums, spot
-
-
-def vol_risk(contract_params: dict, trial=0):
-    # Create the models
-    csvdata = DataModel()
-    model = MCPricer(LVMC)
-
-    ticker = contract_params["ticker"]
-    monthend_datetimes = csvdata.monthend_datetimes(ticker)
-    pricing_datetime = monthend_datetimes[trial]
-    pricing_ts = int(pricing_datetime.timestamp() * 1000)
-    spot = csvdata.get_value(ticker, pricing_datetime)
-
-    # prepare dataset
-    dataset = base_dataset()
-
-    dataset["PRICING_TS"] = pricing_ts
-    dataset["ASSETS"] = dataset_assets(spot, contract_params)
-    dataset["LV"] = {"ASSET": ticker}  # Vol to be added later
-
-    # create timetable for contract
-    timetable = create_timetable(
-        monthend_datetimes, spot, trial, contract_params
-    ).timetable()
-
-    vols = [0.02, 0.05, 0.1, 0.2, 0.3]
-    prices = []
-    for vol in vols:
-        dataset["LV"]["VOL"] = vol
-        price, _ = model.price(timetable, dataset)
-        prices.append(price)
-
-    return vols, prices
+    return sums, ctx.spot
+
+
+def vol_risk(contract_params: dict, trial=0, vols=None):
+    """Price the contract for each vol in vols (default VOL_GRID), all in one batched
+    simulation with common random numbers. Return the vols and the prices."""
+    ladder = price_ladder(contract_params, trial, vols)
+    return ladder["vols"], ladder["prices"]
+
+
+def ladder_dict(vols, prices, se, paths):
+    return {
+        "vols": vols,
+        "prices": prices.tolist(),
+        "se": se.tolist(),
+        "paths": paths,
+    }
+
+
+@cached(ignore=("progress",))
+def price_ladder(
+    contract_params: dict, trial=0, vols=None, coarse_paths=None, progress=None
+):
+    """Price the contract for each vol in vols (default VOL_GRID), see vol_risk.
+    Return a dict with the vols, the prices, their standard errors (se), and the
+    number of paths per vol.
+    If coarse_paths is set, the ladder is first priced with that many paths per vol,
+    and progress (if given) is called with the dict of this coarse estimate, before
+    the remaining paths are added to it."""
+    vols = list(VOL_GRID if vols is None else vols)
+    ctx = pricing_context(contract_params, trial)
+    dataset = ctx.dataset()  # Vols added by the ladder
+    if coarse_paths:
+        dataset["MC"]["COARSE"] = coarse_paths
+
+    def on_batch(prices, se, paths):
+        progress(ladder_dict(vols, prices, se, paths))
+
+    prices, stats = vol_ladder(
+        ctx.timetable(),
+        dataset,
+        vols,
+        progress=None if progress is None else on_batch,
+    )
+    return ladder_dict(vols, prices, stats["SE"], stats["PATHS"])
+
+
+@cached(ignore=("progress",))
+def vol_scenarios(
+    contract_params: dict, trial=0, vols=None, coarse_paths=None, progress=None
+):
+    """Compute everything the future page shows for each vol in vols (default
+    VOL_GRID): the price vs vol curve from price_ladder, and the cashflow sums of
+    model_cashflows, for all vols in one batched simulation.
+    coarse_paths and progress are those of price_ladder.
+    Return a json serializable dict, with cashflows[i] the sums for vols[i]."""
+    # not cached on its own, the result is cached with the cashflows
+    ladder = price_ladder.__wrapped__(
+        contract_params, trial, vols, coarse_paths, progress
+    )
+    vols = ladder["vols"]
+    ctx = pricing_context(contract_params, trial)
+    dataset = ctx.dataset()  # Vols added by the ladder
+
+    # timetable for contract, extended with the forward timetable
+    timetable = ctx.timetable(forward=True)
+
+    # turn on cashflow flag, with a fixed number of paths
+    dataset["MC"]["FLAGS"] = Stats.CASHFLOW
+    dataset["MC"]["PATHS"] = 100  # Too many dots otherwise
+    dataset["MC"].pop("TOL", None)
+    dataset["MC"].pop("BUDGET", None)
+
+    _, stats = vol_ladder(timetable, dataset, vols)
+
+    # Net cashflows for the original and the forward timetable, by vol
+    sums = [
+        sum(stats["CASHFLOW"][i].values()).reshape(len(vols), -1)
+        for i in range(2)
+    ]
+    return {
+        **ladder,
+        "cashflows": [
+            [sums[0][j].tolist(), sums[1][j].tolist()]
+            for j in range(len(vols))
+        ],
+        "spot": ctx.spot,
+    }
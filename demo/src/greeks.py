@@ -0,0 +1,103 @@
+"""
+Greeks of a contract, by bump and revalue: delta and gamma (spot bumps), vega (vol
+bumps) and theta (a later pricing date).
+"""
+
+import os
+from functools import partial
+
+import pandas as pd
+
+from demo.src.cache import cached
+from demo.src.context import pricing_context
+from demo.src.mc import CachedLVMC, adaptive_price
+from demo.src.model import MS_IN_DAY
+from demo.src.utils import dataset_assets, get_executor
+
+# Number of processes for the revaluations, 1 runs them serially.
+GREEKS_WORKERS = int(os.environ.get("GREEKS_WORKERS", "1"))
+
+# Relative spot bump, absolute vol bump, and days for theta.
+SPOT_BUMP = 0.01
+VOL_BUMP = 0.01
+THETA_DAYS = 1
+
+# The revaluations of each trial, as (name, relative spot bump, vol bump, days)
+SCENARIOS = [
+    ("base", 0.0, 0.0, 0),
+    ("spot_up", SPOT_BUMP, 0.0, 0),
+    ("spot_down", -SPOT_BUMP, 0.0, 0),
+    ("vol_up", 0.0, VOL_BUMP, 0),
+    ("vol_down", 0.0, -VOL_BUMP, 0),
+    ("theta", 0.0, 0.0, THETA_DAYS),
+]
+
+
+def revalue(contract_params: dict, vol: float, task):
+    """Price the contract of a trial, in one scenario of SCENARIOS.
+    The timetable is that of the trial, only the market data is bumped. All the
+    scenarios use the same seed and number of paths (common random numbers), so
+    the differences between them are smooth. The spot bumps change only the
+    forwards, so they reuse the paths of the base scenario from the path store
+    (of the process)."""
+    trial, (_, spot_bump, vol_bump, days) = task
+    ctx = pricing_context(contract_params, trial)
+
+    # prepare the bumped dataset, with a fixed number of paths
+    dataset = ctx.dataset(vol + vol_bump)
+    dataset["MC"].pop("TOL", None)
+    dataset["MC"].pop("BUDGET", None)
+
+    dataset["PRICING_TS"] += days * MS_IN_DAY
+    if spot_bump:
+        dataset["ASSETS"] = dataset_assets(
+            ctx.spot * (1 + spot_bump), contract_params
+        )
+
+    price, _ = adaptive_price(CachedLVMC, ctx.timetable(), dataset)
+    return price
+
+
+@cached(ignore=("workers",))
+def greeks(contract_params: dict, trials=(0,), vol=0.3, workers=None):
+    """Compute the greeks of the contract on the trade dates of the trials.
+    The revaluations of all the trials are fanned out over a pool of processes if
+    workers (default GREEKS_WORKERS) is more than one, in as many chunks as workers,
+    so that the scenarios of a single trial run in parallel too. Return a dataframe with a row per trial:
+        price, delta (per unit of spot), gamma (per unit of spot squared),
+        vega (per vol point, i.e. 1%) and theta (per day)."""
+    if workers is None:
+        workers = GREEKS_WORKERS
+
+    tasks = [(trial, scenario) for trial in trials for scenario in SCENARIOS]
+    run_task = partial(revalue, contract_params, vol)
+    if workers > 1 and len(tasks) > 1:
+        chunksize = max(1, len(tasks) // workers)
+        prices = list(
+            get_executor(workers).map(run_task, tasks, chunksize=chunksize)
+        )
+    else:
+        prices = [run_task(task) for task in tasks]
+
+    rows = []
+    for i, trial in enumerate(trials):
+        px = dict(
+            zip(
+                [name for name, *_ in SCENARIOS],
+                prices[i * len(SCENARIOS) : (i + 1) * len(SCENARIOS)],
+            )
+        )
+        ctx = pricing_context(contract_params, trial)
+        ds = SPOT_BUMP * ctx.spot
+        rows.append(
+            {
+                "date": ctx.pricing_datetime,
+                "price": px["base"],
+                "delta": (px["spot_up"] - px["spot_down"]) / (2 * ds),
+                "gamma": (px["spot_up"] - 2 * px["base"] + px["spot_down"])
+                / ds**2,
+                "vega": (px["vol_up"] - px["vol_down"]) / (2 * VOL_BUMP) / 100,
+                "theta": (px["theta"] - px["base"]) / THETA_DAYS,
+            }
+        )
+    return pd.DataFrame(rows)
@@ -0,0 +1,238 @@
+"""
+Background jobs for the heavy callbacks of the app, so that a long pricing never holds
+a web worker. JobManager is dash's DiskcacheManager, with the jobs started from
+standby processes:
+    - each job runs in its own process, started from a standby process that has
+      already imported the app, so a job starts without the import delay.
+    - results, progress and set_props are stored by dash's job function in a
+      diskcache in JOBS_DIR, shared by all the web workers (as gunicorn processes)
+      of the same host. The signing secret is a file next to it.
+    - the job id is the pid, so any web worker can cancel a job by killing it,
+      together with the processes it started (e.g. a pricing pool).
+Besides the public methods of the manager, this relies on the keys of the progress
+and the set_props of a job (_make_progress_key, _make_set_props_key), for the dash
+versions of requirements.txt, as checked by tests/test_jobs.py.
+A new job of a callback supersedes the job of the same callback from the same page
+(session), e.g. while dragging a slider. The new job claims the latest slot of the
+callback in one transaction, so that of concurrent requests (to any web worker) one
+job is the latest. The older job stops at its next call of stop_if_superseded (e.g.
+between two trials), and is killed if it has not stopped after JOBS_GRACE_SECONDS.
+Dash's renderer also drops the older job when it knows of it, this also covers the
+requests that reach another web worker, or that the renderer has not seen finish.
+"""
+
+import multiprocessing
+import os
+import threading
+
+import diskcache
+import psutil
+from dash import DiskcacheManager
+from dash.exceptions import PreventUpdate
+
+from demo.src.cache import CACHE_DIR, CACHE_MAX_BYTES, canonical_key
+
+JOBS_DIR = os.environ.get("DEMO_JOBS_DIR", os.path.join(CACHE_DIR, "jobs"))
+
+# The module that creates the app, imported by the job processes to register the
+# callbacks, and the number of job processes kept ready (0 starts them on demand).
+JOBS_APP_MODULE = os.environ.get("DEMO_JOBS_APP", "app")
+JOBS_STANDBY = int(os.environ.get("DEMO_JOBS_STANDBY", "1"))
+
+# The time a superseded job has to stop by itself, before it is killed.
+JOBS_GRACE_SECONDS = 2.0
+
+# The manager, result key and latest slot of the job run by this process, see
+# stop_if_superseded and props_delivered
+_current_job = None
+
+
+class JobManager(DiskcacheManager):
+    """Run the background callbacks in processes, with the results on disk."""
+
+    def __init__(
+        self,
+        directory=JOBS_DIR,
+        app_module=JOBS_APP_MODULE,
+        standby=JOBS_STANDBY,
+    ):
+        # evicts the results never read, beyond the size limit
+        cache = diskcache.Cache(directory, size_limit=CACHE_MAX_BYTES)
+        self.directory = directory
+        self.app_module = app_module
+        self.standby = standby
+        self.ready = []  # (process, connection) of the standby processes
+        self.processes = {}  # pid -> process, of the jobs started here
+        self.jobs = {}  # key -> (callback, job function), see make_job_fn
+        self.lock = threading.Lock()
+        super().__init__(cache)
+
+    def make_job_fn(self, fn, progress, key=None):
+        """Return the job function that dash makes for the callback, and keep it
+        with the callback under its key, to run it in a job process."""
+        job_fn = super().make_job_fn(fn, progress, key)
+        self.jobs[key] = fn, job_fn
+        return job_fn
+
+    def get_or_create_signing_secret(self, generate):
+        """Store the secret in a file next to the directory of the results, so that
+        it is never evicted, unless another web worker has stored it first, and
+        return the stored secret."""
+        path = os.path.abspath(self.directory) + ".secret"
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(tmp_path, "wb") as f:
+            f.write(generate())
+        try:
+            os.link(tmp_path, path)  # fails if the secret exists
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(tmp_path)
+        with open(path, "rb") as f:
+            return f.read()
+
+    # Processes
+    def start_standby(self):
+        """Start a process that imports the app, and waits for a job."""
+        ctx = multiprocessing.get_context("spawn")
+        parent_conn, child_conn = ctx.Pipe()
+        process = ctx.Process(
+            target=run_standby,
+            args=(child_conn, self.app_module, self.directory),
+        )
+        process.start()
+        child_conn.close()
+        return process, parent_conn
+
+    def call_job_fn(self, key, job_fn, args, context):
+        fn_key = next(k for k, (_, fn) in self.jobs.items() if fn is job_fn)
+        with self.lock:
+            # forget the finished jobs
+            for pid, process in list(self.processes.items()):
+                if not process.is_alive():
+                    del self.processes[pid]
+            if self.ready:
+                process, conn = self.ready.pop(0)
+            else:
+                process, conn = self.start_standby()
+            self.processes[process.pid] = process
+            while len(self.ready) < self.standby:
+                self.ready.append(self.start_standby())
+
+        # claim the latest slot before the job starts, so that it never stops itself
+        latest_key = self.latest_key(fn_key, context)
+        if latest_key is not None:
+            with self.handle.transact():
+                latest = self.handle.get(latest_key)
+                self.handle.set(
+                    latest_key, (process.pid, process_start(process.pid))
+                )
+        conn.send((fn_key, key, args, dict(context)))
+        conn.close()
+
+        if latest_key is not None and latest:
+            old_pid, old_start = latest
+            if process_start(old_pid) == old_start:
+                self.stop_job(old_pid)
+        return process.pid
+
+    def stop_job(self, job, timeout=JOBS_GRACE_SECONDS):
+        """Wait for a superseded job to stop by itself, and kill it if it has not
+        stopped within timeout seconds."""
+        process = self.processes.get(job)
+        if process is not None:
+            process.join(timeout)
+        else:
+            try:  # a job of another web worker
+                psutil.Process(job).wait(timeout)
+            except psutil.Error:
+                pass
+        if self.job_running(job):
+            self.terminate_job(job)
+
+    def latest_key(self, fn_key, context):
+        """Return the key of the latest job of the callback for the page of the
+        request, identified by the signed end id that dash sends with every
+        request of a page load, or None if there is no end id."""
+        session = (context.get("args") or {}).get("endId")
+        if not session:
+            return None
+        return "latest-" + canonical_key(session, fn_key)
+
+    def terminate_job(self, job):
+        """Kill the job and the processes it started. A job started by this web
+        worker is also reaped, through its process."""
+        if not job:
+            return
+        process = self.processes.pop(int(job), None)
+        if process is None:
+            super().terminate_job(job)  # e.g. a job of another web worker
+            return
+        try:
+            children = psutil.Process(process.pid).children(recursive=True)
+        except psutil.NoSuchProcess:
+            children = []
+        for child in children:
+            try:
+                child.kill()
+            except psutil.NoSuchProcess:
+                pass
+        process.kill()
+        process.join(1)
+
+
+def process_start(pid):
+    """Return the start time of a process, to tell it from a later process with
+    the same pid, or None if there is no such process."""
+    try:
+        return psutil.Process(pid).create_time()
+    except psutil.Error:
+        return None
+
+
+def run_standby(conn, app_module, directory):
+    """Import the app, wait for a job, and run it with the job function that dash
+    makes for the callback (see DiskcacheManager)."""
+    global _current_job
+    manager = JobManager(directory, standby=0)
+    if not manager.jobs:
+        # unless the callbacks are registered by the main module (__mp_main__),
+        # dash registers them with every manager as the app is imported
+        __import__(app_module)
+    try:
+        fn_key, result_key, args, context = conn.recv()
+    except EOFError:
+        return  # the web worker has exited
+    finally:
+        conn.close()
+
+    _current_job = manager, result_key, manager.latest_key(fn_key, context)
+    _, job_fn = manager.jobs[fn_key]
+    job_fn(result_key, manager._make_progress_key(result_key), args, context)
+
+
+def stop_if_superseded():
+    """Stop the job run by this process if a newer job of the same callback has
+    been started from the same page, by raising PreventUpdate, so that the job
+    leaves the outputs as they are. Call it between the steps of a long callback,
+    it does nothing outside of a job."""
+    if _current_job is None:
+        return
+    manager, _, latest_key = _current_job
+    if latest_key is None:
+        return
+    latest = manager.handle.get(latest_key)
+    if latest and latest[0] != os.getpid():
+        raise PreventUpdate
+
+
+def props_delivered():
+    """Return whether the renderer has fetched the props last set (by set_props)
+    by the job run by this process. Each set_props replaces the props not yet
+    fetched, so a job that sends partial updates (as a Patch) waits for this before
+    it sends the next one. Always True outside of a job."""
+    if _current_job is None:
+        return True
+    manager, result_key, _ = _current_job
+    return manager.handle.get(manager._make_set_props_key(result_key)) is None
@@ -0,0 +1,399 @@
+"""
+Monte-Carlo model states used by the app, on top of the finmc local vol model.
+"""
+
+import hashlib
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+from finmc.models.localvol import LVMC
+from finmc.utils.assets import Discounter, Forwards
+from numpy.random import SFC64, Generator
+from qablet.base.flags import Stats
+from qablet.base.mc import MCPricer
+
+from demo.src.cache import LRUCache, canonical_key
+from demo.src.sampling import make_sampler, step_times
+
+PATH_CACHE_BYTES = int(os.environ.get("DEMO_PATHS_MB", "256")) * 1024 * 1024
+BATCH_PATHS = 2_000  # default paths per batch of an adaptive run
+QMC_BATCHES = (
+    8  # independently scrambled batches of a Sobol run, for its error
+)
+
+
+class PathStore:
+    """A store of simulated paths (the log stock x_vec after each step), so that a
+    contract whose terms change (e.g. the strike) reuses the paths instead of
+    simulating them again. Each entry holds the paths as they were simulated, together
+    with the state of the random number generator after the step, so that a
+    simulation can continue from a stored step. Entries are kept in an in-process LRU
+    bounded by bytes."""
+
+    def __init__(self, max_bytes=PATH_CACHE_BYTES):
+        self.memory = LRUCache(maxsize=2**31, max_bytes=max_bytes)
+        self.lock = threading.Lock()  # for the counters
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def record_dtype(n):
+        return np.dtype([("x", np.float64, (n,)), ("rng", np.uint64, (6,))])
+
+    def get(self, key):
+        """Return the stored (x_vec, rng words) for the key, or None."""
+        record = self.memory.get(key)
+        with self.lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return record["x"][0], record["rng"][0]
+
+    def put(self, key, x_vec, rng_words):
+        record = np.empty(1, dtype=self.record_dtype(len(x_vec)))
+        record["x"][0] = x_vec
+        record["rng"][0] = rng_words
+        self.memory.put(key, record)
+
+    def clear(self):
+        self.memory.clear()
+
+
+PATH_STORE = PathStore()
+
+
+def rng_to_words(bit_generator) -> np.ndarray:
+    """Pack the state of an SFC64 bit generator into six words."""
+    state = bit_generator.state
+    flags = np.array([state["has_uint32"], state["uinteger"]], dtype=np.uint64)
+    return np.concatenate([state["state"]["state"], flags])
+
+
+def words_to_rng(bit_generator, words):
+    """Restore the state of an SFC64 bit generator from six words."""
+    bit_generator.state = {
+        "bit_generator": "SFC64",
+        "state": {"state": np.array(words[:4], dtype=np.uint64)},
+        "has_uint32": int(words[4]),
+        "uinteger": int(words[5]),
+    }
+
+
+class SampledLVMC(LVMC):
+    """Local vol MC state, with the normal increments drawn by the sampler selected
+    by the MC section of the dataset (see demo.src.sampling)."""
+
+    def reset(self):
+        super().reset()
+        self.sampler = make_sampler(self.dataset["MC"], self.n, self.rng)
+
+    def step(self, new_time):
+        """Update x_vec in place when we move simulation by time dt."""
+        dt = new_time - self.cur_time
+
+        if callable(self.vol):
+            vol = self.vol((self.cur_time, self.x_vec))
+        else:
+            vol = self.vol
+
+        # generate the random numbers and advance the log stock process
+        self.sampler.draw(dt, self.dz_vec)
+        self.dz_vec *= vol
+
+        # add the drift, - vol * vol * dt / 2.0, and the random part
+        np.multiply(vol, vol, out=self.tmp)
+        self.tmp *= -0.5 * dt
+        self.x_vec += self.tmp
+        self.x_vec += self.dz_vec
+
+        self.cur_time = new_time
+
+
+class CachedLVMC(SampledLVMC):
+    """Local vol MC state, that stores its simulated paths in the PATH_STORE.
+
+    The paths depend only on the number of paths, the vol, the seed, the sampling
+    and the sequence of step times, not on the contract or on the forwards. Each step is keyed by a
+    chained hash of these inputs, so when only the contract terms change the steps are
+    loaded from the store, and the payoffs are evaluated on the stored paths.
+    The paths are stored as simulated, so the prices are those of SampledLVMC,
+    whether or not the paths were found in the store."""
+
+    path_store = PATH_STORE
+
+    def reset(self):
+        super().reset()
+        self.step_key = self.simulation_key()
+
+    def simulation_key(self):
+        """Return the key of the simulation inputs, or None if the paths can not be
+        stored, e.g. with a callable local vol."""
+        if callable(self.vol):
+            return None
+        mc = self.dataset["MC"]
+        sampling = [mc.get(k) for k in ("SAMPLING", "ANTITHETIC", "TIMES")]
+        return canonical_key(
+            "LVMC", self.n, self.vol, mc.get("SEED"), sampling
+        )
+
+    def step(self, new_time):
+        """Load x_vec from the store, or advance it and add it to the store."""
+        if self.step_key is None:
+            return super().step(new_time)
+
+        digest = hashlib.blake2b(self.step_key.encode(), digest_size=16)
+        digest.update(struct.pack("d", new_time))
+        self.step_key = digest.hexdigest()
+
+        stored = self.path_store.get(self.step_key)
+        if stored is not None:
+            x_vec, rng_words = stored
+            self.x_vec[:] = x_vec
+            words_to_rng(self.rng.bit_generator, rng_words)
+            self.sampler.skip()
+            self.cur_time = new_time
+            return
+
+        super().step(new_time)
+        self.path_store.put(
+            self.step_key, self.x_vec, rng_to_words(self.rng.bit_generator)
+        )
+
+
+class LadderLVMC(SampledLVMC):
+    """Local vol MC state for a ladder of flat vols (dataset["LV"]["VOLS"]), simulated
+    in a single pass. The engine sees PATHS paths per vol, stacked vol by vol, and all
+    the vols share the same normal draws (common random numbers), so the prices along
+    the ladder differ only because of the vol, and the curve is smooth.
+
+    The draws are those of LVMC with PATHS paths, so each vol of the ladder gets the
+    same paths as a separate LVMC run with that vol."""
+
+    def reset(self):
+        mc = self.dataset["MC"]
+        vols = np.asarray(self.dataset["LV"]["VOLS"], dtype=np.float64)
+        self.num_vols = len(vols)
+        self.num_paths = mc["PATHS"] // self.num_vols
+        self.n = self.num_paths * self.num_vols
+        self.timestep = mc["TIMESTEP"]
+
+        self.asset = self.dataset["LV"]["ASSET"]
+        self.asset_fwd = Forwards(self.dataset["ASSETS"][self.asset])
+        self.vol = np.repeat(vols, self.num_paths)
+        self.discounter = Discounter(
+            self.dataset["ASSETS"][self.dataset["BASE"]]
+        )
+
+        # Create rng and tmp arrays, the draws are shared by all the vols
+        self.rng = Generator(SFC64(mc.get("SEED")))
+        self.sampler = make_sampler(mc, self.num_paths, self.rng)
+        self.dz_base = np.empty(self.num_paths, dtype=np.float64)
+        self.dz_vec = np.empty(self.n, dtype=np.float64)
+        self.tmp = np.empty(self.n, dtype=np.float64)
+
+        # Initialize the process
+        self.x_vec = np.zeros(self.n)  # process x (log stock)
+        self.cur_time = 0
+
+    def step(self, new_time):
+        """Update x_vec in place, with the same draws for every vol."""
+        dt = new_time - self.cur_time
+
+        self.sampler.draw(dt, self.dz_base)
+        self.dz_vec.reshape(self.num_vols, self.num_paths)[:] = self.dz_base
+        self.dz_vec *= self.vol
+
+        # add the drift, - vol * vol * dt / 2.0, and the random part
+        np.multiply(self.vol, self.vol, out=self.tmp)
+        self.tmp *= -0.5 * dt
+        self.x_vec += self.tmp
+        self.x_vec += self.dz_vec
+
+        self.cur_time = new_time
+
+
+def batch_seed(seed, batch: int):
+    """Return the seed of a batch. The first batch uses the seed of the dataset, so
+    a run of one batch is the same as a plain run."""
+    if batch == 0:
+        return seed
+    sequence = np.random.SeedSequence([seed or 0, batch])
+    return int(sequence.generate_state(1)[0])
+
+
+def with_step_times(timetable, dataset):
+    """Return the dataset, with the step times of the timetable added to the MC
+    section if the sampler needs them (Sobol sampling)."""
+    if dataset["MC"].get("SAMPLING", "PSEUDO") != "SOBOL":
+        return dataset
+    times = step_times(timetable, dataset)
+    return {**dataset, "MC": {**dataset["MC"], "TIMES": times}}
+
+
+def qmc_error(batch_sums, batch_pairs):
+    """Return the standard error of the prices of a Sobol run, from the sums of the
+    pairs (a row per batch, a column per price) and the number of pairs of each
+    independently scrambled batch: the spread of the batch means, weighted by their
+    pairs, divided by the square root of the number of batches."""
+    num_batches = len(batch_pairs)
+    if num_batches < 2:
+        return np.full(batch_sums.shape[1], np.nan)
+    weights = batch_pairs / batch_pairs.sum()
+    batch_means = batch_sums / batch_pairs[:, None]
+    mean = weights @ batch_means
+    var = weights @ np.square(batch_means - mean)
+    return np.sqrt(var / (num_batches - 1))
+
+
+def run_batches(price_batch, dataset, progress=None):
+    """Run the MC in batches of paths, until the standard error of every price is
+    below dataset["MC"]["TOL"] times the price (a relative tolerance, since the
+    notes are priced per 100 notional and the options in units of spot), or the
+    time spent is above dataset["MC"]["BUDGET"] (seconds), or dataset["MC"]["PATHS"]
+    paths have been run. Without TOL and BUDGET all the paths are run in one batch.
+    The batch size is dataset["MC"]["BATCH"].
+
+    If dataset["MC"]["COARSE"] is set, the first batch has that many paths, for a
+    quick estimate, and the next batches add paths to it (without TOL and BUDGET,
+    all the remaining paths in a second batch). The batches have their own seeds,
+    so the refined prices are those of the same run, with more paths.
+
+    price_batch(dataset) must return the prices, the per path values, as an array
+    with a row per price, and the stats of the engine. The antithetic pairs of
+    paths are averaged first, so the standard error accounts for them.
+    With Sobol sampling the paths of a batch are not independent, each batch is an
+    independent scrambling of the sequence, and the standard error is that of the
+    mean of the batch means (nan for a single batch). Without TOL and BUDGET the
+    paths are run in QMC_BATCHES batches.
+    If given, progress(prices, se, paths) is called after each batch but the last.
+    Return the prices, their standard errors, the number of paths, and the stats of
+    the last batch, with the per path stats of all the batches (see
+    join_path_stats)."""
+    mc = dataset["MC"]
+    tol, budget = mc.get("TOL"), mc.get("BUDGET")
+    max_paths = mc["PATHS"]
+    is_qmc = mc.get("SAMPLING", "PSEUDO") == "SOBOL"
+    if tol is None and budget is None:
+        batch_paths = max_paths
+        if is_qmc:
+            batch_paths = max(2, max_paths // QMC_BATCHES)
+    else:
+        batch_paths = min(max_paths, mc.get("BATCH", BATCH_PATHS))
+    next_paths = batch_paths
+    if mc.get("COARSE"):
+        batch_paths = min(max_paths, mc["COARSE"])
+
+    start = time.perf_counter()
+    paths, sums, sumsq = 0, 0.0, 0.0
+    batch_sums, batch_pairs = [], []  # of each batch, for a Sobol run
+    batch_stats = []
+    batch = 0
+    while True:
+        batch_mc = {
+            k: v
+            for k, v in mc.items()
+            if k not in ("TOL", "BUDGET", "BATCH", "COARSE")
+        }
+        batch_mc["PATHS"] = batch_paths + batch_paths % 2
+        batch_mc["SEED"] = batch_seed(mc.get("SEED"), batch)
+        batch_mc["FLAGS"] = mc.get("FLAGS", 0) | Stats.PV_VEC
+        prices, pv, stats = price_batch({**dataset, "MC": batch_mc})
+        batch_stats.append(stats)
+
+        pairs = pv.reshape(len(pv), 2, -1).mean(axis=1)
+        paths += batch_mc["PATHS"]
+        sums = sums + pairs.sum(axis=1)
+        sumsq = sumsq + np.square(pairs).sum(axis=1)
+        batch_sums.append(pairs.sum(axis=1))
+        batch_pairs.append(pairs.shape[1])
+        batch += 1
+
+        num_pairs = paths // 2
+        means = sums / num_pairs
+        if is_qmc:
+            se = qmc_error(np.array(batch_sums), np.array(batch_pairs))
+        else:
+            var = np.maximum(sumsq - num_pairs * means**2, 0.0)
+            se = np.sqrt(var / max(num_pairs - 1, 1) / num_pairs)
+        if batch == 1:
+            means = prices  # the price of the engine
+
+        if (
+            paths >= max_paths
+            or (tol is not None and np.all(se <= tol * np.abs(means)))
+            or (budget is not None and time.perf_counter() - start >= budget)
+        ):
+            return means, se, paths, join_path_stats(batch_stats, len(pv))
+        if progress is not None:
+            progress(means, se, paths)
+        batch_paths = min(next_paths, max_paths - paths)
+
+
+def join_path_stats(batch_stats, rows):
+    """Return the stats of the last batch, with the per path stats (PV_VEC and
+    CASHFLOW) of all the batches joined. Their arrays hold the paths of each of the
+    rows (prices) in turn, so the paths are joined row by row."""
+    stats = batch_stats[-1]
+    if len(batch_stats) == 1:
+        return stats
+
+    def join(arrays):
+        return np.concatenate(
+            [a.reshape(rows, -1) for a in arrays], axis=1
+        ).reshape(-1)
+
+    stats = {**stats}
+    if "PV_VEC" in stats:
+        stats["PV_VEC"] = join([s["PV_VEC"] for s in batch_stats])
+    if "CASHFLOW" in stats:
+        stats["CASHFLOW"] = {
+            i: {
+                k: join([s["CASHFLOW"][i][k] for s in batch_stats]) for k in cf
+            }
+            for i, cf in stats["CASHFLOW"].items()
+        }
+    return stats
+
+
+def adaptive_price(state_class, timetable, dataset):
+    """Price a timetable like MCPricer(state_class).price, in batches of paths (see
+    run_batches). Return the price, and the stats, with the standard error of the
+    price (SE) and the number of paths run (PATHS)."""
+
+    def price_batch(batch_dataset):
+        price, stats = MCPricer(state_class).price(timetable, batch_dataset)
+        return np.array([price]), stats["PV_VEC"].reshape(1, -1), stats
+
+    dataset = with_step_times(timetable, dataset)
+    prices, se, paths, stats = run_batches(price_batch, dataset)
+    return float(prices[0]), {**stats, "SE": float(se[0]), "PATHS": paths}
+
+
+def vol_ladder(timetable, dataset, vols, progress=None):
+    """Price a timetable for each of the flat vols, in one batched simulation with
+    common random numbers. dataset["MC"]["PATHS"] is the number of paths per vol,
+    and the paths are run in batches, as in adaptive_price, with progress called
+    after each batch but the last (see run_batches).
+    Return an array with the price for each vol, and the stats of the engine, where
+    the per path arrays are stacked vol by vol, with the standard error of each
+    price (SE) and the number of paths per vol (PATHS)."""
+    num_vols = len(vols)
+
+    def price_batch(batch_dataset):
+        ladder = {**batch_dataset}
+        ladder["MC"] = {
+            **batch_dataset["MC"],
+            "PATHS": batch_dataset["MC"]["PATHS"] * num_vols,
+        }
+        ladder["LV"] = {**batch_dataset["LV"], "VOLS": list(vols)}
+        _, stats = MCPricer(LadderLVMC).price(timetable, ladder)
+        pv = stats["PV_VEC"].reshape(num_vols, -1)
+        return pv.mean(axis=1), pv, stats
+
+    dataset = with_step_times(timetable, dataset)
+    prices, se, paths, stats = run_batches(price_batch, dataset, progress)
+    return prices, {**stats, "SE": se, "PATHS": paths}
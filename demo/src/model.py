@@ -1,9 +1,11 @@
 from datetime import datetime
 
+import numpy as np
 import polars as pl
 from qablet.base.cf import CFModelPyBase
 
-MS_IN_DAY = 1000 * 3600 * 24
+from demo.src.spots import MS_IN_DAY, SPOTS_FILE, get_store
+
 TS_TO_YEARS = 1 / (365 * MS_IN_DAY)
 
 
@@ -11,16 +13,13 @@ class CFModelPyCSV(CFModelPyBase):
     """CFModel that uses data from a CSV and interfaces with qablet cashflow model."""
 
     def __init__(self, filename, base):
-        """Read the csv file on initialization. Assumes that there is a date column and the
-        data is sorted by the date column. Assumes that the other columns are the units.
-        infer_schema_length is set to None, which causes the csv reader to read the whole file
-        before inferring the schema. This is needed if the first row may have blanks. A faster
-        read can be accomplished by supplying the schema directly."""
+        """Use the shared spot store for the csv file, which is read only once per
+        process. See demo.src.spots for the assumptions about the file."""
 
-        self.data = pl.read_csv(
-            filename, try_parse_dates=True, infer_schema_length=None
-        ).set_sorted("date")
-        self.ts = self.data["date"].cast(int)
+        self.store = get_store(filename)
+        self.data = self.store.data
+        self.ts = self.store.days
+        self.fixings = {}
 
         super().__init__(base)
 
@@ -29,10 +28,52 @@ class CFModelPyCSV(CFModelPyBase):
         search_sorted is faster than filter by date. It picks the date on or before the ts.
         it appears that polars stores dates as a day timestamp, so a conversion is
         needed from qablet's milliseconds timestamp."""
-        row = self.ts.search_sorted(ts // MS_IN_DAY)
-        val = self.data.item(row, unit)
+        val = self.fixings.get((unit, ts))
+        if val is None:
+            row = self.ts.search_sorted(ts // MS_IN_DAY)
+            val = self.data.item(row, unit)
         return val
 
+    def get_values(self, units, ts):
+        """Return values for given unit (or list of units), on given timestamps (ms).
+        All timestamps are resolved by a single sorted search on the date column, with
+        the same convention as get_value. Return an array of shape (len(ts),) for a
+        unit, or (len(units), len(ts)) for a list of units. Nulls are returned as nan."""
+        rows = np.searchsorted(
+            self.ts.to_numpy(), np.asarray(ts, dtype=np.int64) // MS_IN_DAY
+        )
+        if isinstance(units, str):
+            return self.store.values(units)[rows]
+        return np.array([self.store.values(unit)[rows] for unit in units])
+
+    def prefetch(self, timetable):
+        """Look up the fixings of all data units in the timetable, in one batch, so that
+        the calls to get_value during the cashflow replay become dict lookups. A
+        missing fixing (null) is not prefetched, so get_value returns None for it, as
+        without the prefetch."""
+        events = timetable["events"]
+        units = set(events["unit"].to_pylist())
+        for expr in timetable.get("expressions", {}).values():
+            units.update(expr.get("inp", []))
+        units = [unit for unit in units if unit in self.store.data.columns]
+        if not units:
+            return
+
+        ts = np.unique(events["time"].cast("int64").to_numpy())
+        ts = ts[ts // MS_IN_DAY <= self.ts[-1]]  # skip times beyond the data
+        values = self.get_values(units, ts)
+        for unit, unit_values in zip(units, values):
+            # the nulls are left to get_value, which returns None for them
+            valid = ~np.isnan(unit_values)
+            keys = [(unit, t) for t in ts[valid].tolist()]
+            self.fixings.update(zip(keys, unit_values[valid].tolist()))
+
+    def cashflow(self, timetable):
+        """Replay the timetable on the historical data, with prefetched fixings."""
+        self.fixings = {}
+        self.prefetch(timetable)
+        return super().cashflow(timetable)
+
 
 def get_cf(pricing_ts, timetable, stats):
     """Return cashflows and years for a given timetable and stats."""
@@ -44,7 +85,7 @@ def get_cf(pricing_ts, timetable, stats):
     )[df["index"]]
     df = df.with_columns(ts=ts_col)
     # net cashflows by timestamp
-    df = df.group_by("ts").agg(pl.col("value").sum())
+    df = df.group_by("ts", maintain_order=True).agg(pl.col("value").sum())
 
     cf_vec = df["value"].to_numpy()
     ts_vec = df["ts"].to_numpy()
@@ -52,14 +93,39 @@ def get_cf(pricing_ts, timetable, stats):
     return yrs_vec, cf_vec, ts_vec
 
 
+def get_cfs(pricing_ts, times, event_offsets, cashflows):
+    """Return the cashflows and years of many trials at once, the batched get_cf.
+    pricing_ts has the pricing timestamp of each trial, times the timestamps (ms) of
+    the events of all the trials, the events of trial i being the rows
+    event_offsets[i]:event_offsets[i+1], and cashflows the table of replay.
+    The cashflows are netted by (trial, timestamp) in one group by. Return the
+    years, cashflows and timestamps of all trials, as contiguous arrays, and the
+    offsets of each trial in them."""
+    df = pl.from_arrow(cashflows)
+    trial = df["trial"].to_numpy()
+    index = df["index"].cast(pl.Int64).to_numpy()
+    rows = np.asarray(event_offsets, np.int64)[trial] + index
+    df = df.with_columns(ts=pl.Series(np.asarray(times, np.int64)[rows]))
+    df = df.group_by(["trial", "ts"], maintain_order=True).agg(
+        pl.col("value").sum()
+    )
+
+    trial = df["trial"].to_numpy()
+    cf_vec = df["value"].to_numpy()
+    ts_vec = df["ts"].to_numpy()
+    pricing_ts = np.asarray(pricing_ts, np.int64)
+    yrs_vec = (ts_vec - pricing_ts[trial]).astype(float) * TS_TO_YEARS
+    offsets = np.searchsorted(trial, np.arange(len(pricing_ts) + 1))
+    return yrs_vec, cf_vec, ts_vec, offsets
+
+
 class DataModel:
     """A Datamodel (for csv files) used by the app. We will keep it separate from
     the qablet model."""
 
-    def __init__(self, filename="demo/data/spots.csv"):
-        self.data = pl.read_csv(
-            filename, try_parse_dates=True, infer_schema_length=None
-        ).set_sorted("date")
+    def __init__(self, filename=SPOTS_FILE):
+        self.store = get_store(filename)
+        self.data = self.store.data
         self.start_date = datetime(2019, 12, 31)
         self.end_date = datetime(2024, 4, 30)
 
@@ -75,29 +141,15 @@ class DataModel:
             pl.col("date") <= end
         )
 
-    def monthend_datetimes(self, ticker):
-        """Return month-end datetimes for a given ticker."""
-
-        # First generate month-end dates using Polars
-        monthend_datetimes = pl.datetime_range(
-            self.start_date, self.end_date, "1mo", eager=True, time_zone="UTC"
+    def schedule_ts(self, ticker, freq="1mo"):
+        """Return timestamps (ms) of the trading dates for a given ticker, at the end
+        of each period of the given frequency, e.g. "1mo" or "1w"."""
+        return self.store.schedule_ts(
+            ticker, self.start_date, self.end_date, freq
         )
 
-        # Find valid dates for the ticker
-        valid_ticker_data = self.data.select(["date", ticker]).drop_nulls()
-        valid_datetimes = (
-            valid_ticker_data["date"]
-            .cast(datetime)
-            .dt.convert_time_zone("UTC")
-        )
-
-        # Adjust the dates to the nearest trading date for that ticker (on or before)
-        adjusted_datetimes = []
-        for dt in monthend_datetimes:
-            idx = valid_datetimes.search_sorted(dt, side="right") - 1
-            if idx >= 0:
-                adjusted_datetimes.append(valid_datetimes[idx])
-            else:
-                raise ValueError(f"No valid date found for {dt}")
-
-        return adjusted_datetimes
+    def monthend_datetimes(self, ticker):
+        """Return month-end datetimes for a given ticker, adjusted to the nearest
+        trading date for that ticker (on or before)."""
+        ts = pl.Series(self.schedule_ts(ticker, "1mo"))
+        return ts.cast(pl.Datetime("ms", "UTC")).to_list()
@@ -0,0 +1,96 @@
+"""
+Server-side storage for the cashflows of a backtest, so that the browser only holds a
+short key instead of the full payload. The payload is one Arrow table, with a row per
+cashflow and a trial column, written to the shared cache directory and memory-mapped
+by any worker that needs it.
+"""
+
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+import pyarrow as pa
+
+from demo.src.cache import CACHE_DIR, DiskCache, LRUCache
+
+PAYLOAD_CACHE = DiskCache(os.path.join(CACHE_DIR, "payloads"), suffix=".arrow")
+KEY_PATTERN = re.compile("[0-9a-f]{32}")
+
+_tables = LRUCache()
+
+
+def stats_to_arrow(stats: dict) -> pa.Table:
+    """Convert the stats of run_backtest into a columnar table. The per trial values
+    (price, trade and maturity timestamps) and the row offsets of each trial are kept
+    in the table metadata."""
+    trials = stats["stats"]
+    counts = [len(ts) for ts, _, _ in trials]
+    table = pa.table(
+        {
+            "trial": np.repeat(np.arange(len(trials), dtype=np.int32), counts),
+            "ts": np.concatenate(
+                [np.empty(0, dtype=np.int64)]
+                + [np.asarray(ts, dtype=np.int64) for ts, _, _ in trials]
+            ),
+            "cf": np.concatenate(
+                [np.empty(0)]
+                + [np.asarray(cf, dtype=float) for _, cf, _ in trials]
+            ),
+        }
+    )
+    metadata = {
+        "ticker": stats["ticker"],
+        "prices": [px for _, _, px in trials],
+        "ts": [list(ts) for ts in stats["ts"]],
+        "offsets": np.cumsum([0] + counts).tolist(),
+    }
+    return table.replace_schema_metadata({"payload": json.dumps(metadata)})
+
+
+def put_payload(stats: dict) -> str:
+    """Store the stats of run_backtest, and return its key."""
+    table = stats_to_arrow(stats)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    data = sink.getvalue().to_pybytes()
+
+    key = hashlib.sha256(data).hexdigest()[:32]
+    PAYLOAD_CACHE.put(key, data)
+    _tables.put(key, table)
+    return key
+
+
+def get_payload(key: str):
+    """Return the payload table for a key, or None if the key is unknown, e.g. it
+    has been evicted."""
+    if not isinstance(key, str) or not KEY_PATTERN.fullmatch(key):
+        return None
+    table = _tables.get(key)
+    if table is None:
+        try:
+            source = pa.memory_map(PAYLOAD_CACHE.path(key))
+            table = pa.ipc.open_file(source).read_all()
+        except (OSError, pa.ArrowInvalid):
+            return None
+        _tables.put(key, table)
+    return table
+
+
+def get_trial(key: str, idx: int):
+    """Return the (trade, maturity) timestamps, the cashflow and the ticker of a
+    trial, in the form used by plot_cashflow, or None if the key is unknown."""
+    table = get_payload(key)
+    if table is None:
+        return None
+    metadata = json.loads(table.schema.metadata[b"payload"])
+    start, end = metadata["offsets"][idx], metadata["offsets"][idx + 1]
+    rows = table.slice(start, end - start)
+    cf = (
+        rows["ts"].to_pylist(),
+        rows["cf"].to_pylist(),
+        metadata["prices"][idx],
+    )
+    return tuple(metadata["ts"][idx]), cf, metadata["ticker"]
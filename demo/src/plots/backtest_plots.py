@@ -2,11 +2,13 @@
 Methods to crete figures for the backtest page.
 """
 
+import json
 from datetime import datetime
 
 import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
+import polars as pl
 import pytz
 from plotly.subplots import make_subplots
 from demo.src.model import MS_IN_DAY, DataModel
@@ -29,6 +31,40 @@ def blank_figure():
     return fig
 
 
+def cashflow_subplots(ticker):
+    """Create the two row figure for the cashflow plot, with the cashflow bars on
+    the top and the ticker on the bottom, and its static layout."""
+    fig = make_subplots(
+        rows=2,
+        cols=1,
+        row_heights=[0.6, 0.4],
+        shared_xaxes=True,
+        vertical_spacing=0.0,
+    )
+    fig.update_layout(
+        height=250,
+        margin={"l": 40, "b": 40, "t": 10, "r": 0},
+        template="plotly_dark",
+        showlegend=False,
+    )
+    fig.update_yaxes(
+        title_text="Cashflow",
+        side="left",
+        color="aquamarine",
+        row=1,
+        col=1,
+    )
+    fig.update_yaxes(
+        title_text=ticker,
+        side="right",
+        color="dimgrey",
+        showticklabels=False,
+        row=2,
+        col=1,
+    )
+    return fig
+
+
 def plot_cashflow(dates, cf, ticker):
     prc_ts, end_ts = dates
     prc_dt = datetime.fromtimestamp(prc_ts // 1000, pytz.utc)
@@ -42,13 +78,7 @@ def plot_cashflow(dates, cf, ticker):
 
     color = np.where(y < 0, "coral", "aquamarine")
 
-    fig = make_subplots(
-        rows=2,
-        cols=1,
-        row_heights=[0.6, 0.4],
-        shared_xaxes=True,
-        vertical_spacing=0.0,
-    )
+    fig = cashflow_subplots(ticker)
 
     fig.add_trace(
         go.Bar(
@@ -84,30 +114,9 @@ def plot_cashflow(dates, cf, ticker):
         row=2,
         col=1,
     )
-    fig.update_layout(
-        height=250,
-        margin={"l": 40, "b": 40, "t": 10, "r": 0},
-        template="plotly_dark",
-        showlegend=False,
-    )
-    fig.update_yaxes(
-        title_text="Cashflow",
-        side="left",
-        color="aquamarine",
-        row=1,
-        col=1,
-    )
     start_spot = tickerdf[ticker][0]
 
-    fig.update_yaxes(
-        title_text=ticker,
-        side="right",
-        color="dimgrey",
-        showticklabels=False,
-        tickvals=[start_spot],
-        row=2,
-        col=1,
-    )
+    fig.update_yaxes(tickvals=[start_spot], row=2, col=1)
     fig.add_annotation(
         x=prc_dt,
         y=start_spot,
@@ -132,6 +141,29 @@ def plot_cashflow(dates, cf, ticker):
     return fig
 
 
+def cashflow_figure_data(stats):
+    """Return all that the browser needs to draw the cashflow plot of any trade
+    (see assets/past_cashflow.js), to be sent once with the IRR plot: the cashflows
+    of all trades, the ticker spots covering all trades, and the figure layout."""
+    ticker = stats["ticker"]
+    start_ts = min(ts[0] for ts in stats["ts"])
+    end_ts = max(ts[1] for ts in stats["ts"])
+    start_dt = datetime.fromtimestamp(start_ts // 1000, pytz.utc)
+    end_dt = datetime.fromtimestamp(end_ts // 1000, pytz.utc)
+
+    tickerdf = DataModel().get_curve(start_dt, end_dt)
+    layout = json.loads(cashflow_subplots(ticker).to_json())["layout"]
+    return {
+        "ticker": ticker,
+        "dates": stats["ts"],
+        "stats": stats["stats"],
+        "spot_ts": (tickerdf["date"].cast(pl.Int64) * MS_IN_DAY).to_list(),
+        "spot": tickerdf[ticker].to_list(),
+        "bar_width": MS_IN_DAY * 2,
+        "layout": layout,
+    }
+
+
 def plot_irr(x, y, annualized=True, ticker="SPX"):
     """Plot a IRR scatter plot on the left, and histogram on the right."""
 
@@ -103,13 +103,17 @@ def plot_cf_vs_spot(cfsums, spot, vol, params):
     return fig
 
 
-def plot_price_vol(vols, prices):
-    """Plot Price vs Vol."""
+def plot_price_vol(vols, prices, se=None):
+    """Plot Price vs Vol, with error bars of two standard errors if se is given."""
 
+    error_y = None
+    if se is not None:
+        error_y = dict(type="data", array=2 * np.asarray(se), color="grey")
     fig = go.Figure(
         go.Scatter(
             x=vols,
             y=prices,
+            error_y=error_y,
             marker=dict(color="coral", size=20, opacity=0.7),
         )
     )
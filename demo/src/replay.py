@@ -0,0 +1,223 @@
+"""
+Replay the timetables of many trials on the historical data at once, the batched
+equivalent of CFModelPyCSV.cashflow (qablet's backtest_py) for each trial.
+
+The timetables are stacked into one Arrow table with a trial column. The fixings of
+all the events are resolved by one sorted search against the spot store, and the
+timetables with the same sequence of (op, unit) are evaluated column-wise, one array
+per event with a value per trial:
+    "+"            pay quantity * unit.
+    ">" and "<"    the holder (or the issuer) takes quantity * unit instead of the
+                   rest of the contract, if it is larger (smaller), with hindsight.
+    a phrase name  if the phrase is true, pay quantity * unit and terminate.
+    None           apply the snapper named by the unit, to update its state.
+The unit is the base currency, a column of the spots, a phrase, or a state variable.
+Only the expression functions are called per trial, since each trial has its own.
+"""
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+from demo.src.spots import MS_IN_DAY, get_store
+
+CHOICE_OPS = (">", "<")
+
+
+def stack_timetables(timetables):
+    """Stack the events of the timetables into one table, with a trial column (the
+    position of the timetable in the list). Return the table, and the list of
+    the expressions of each trial."""
+    batches = [
+        tt["events"].append_column(
+            "trial", pa.array(np.full(tt["events"].num_rows, trial, np.int32))
+        )
+        for trial, tt in enumerate(timetables)
+    ]
+    events = pa.Table.from_batches(batches)
+    return events, [tt.get("expressions", {}) for tt in timetables]
+
+
+class TrialGroup:
+    """The trials with the same sequence of (op, unit), evaluated together."""
+
+    def __init__(self, trials, rows, ops, units, quantity, fixing_rows):
+        self.trials = trials  # (num_trials,) trial ids
+        self.rows = rows  # (num_trials, num_events) rows in the stacked table
+        self.ops = ops
+        self.units = units
+        self.quantity = quantity[rows]
+        self.fixing_rows = fixing_rows[rows]
+        self.state = {}
+
+
+def replay(events, expressions, base="USD", store=None) -> pa.Table:
+    """Replay the stacked timetables (see stack_timetables) on the spots of the store
+    (default: the shared spot store). Return a table with the trial, the index of
+    the event in its timetable, and the value of its cashflow, for the same events
+    as CFModelPyCSV.cashflow, i.e. "+" events and the other events with a non zero
+    quantity, sorted by trial and index."""
+    store = get_store() if store is None else store
+    df = pl.from_arrow(events)
+    trial_col = df["trial"].to_numpy()
+    if np.any(np.diff(trial_col) < 0):
+        raise ValueError("The events must be sorted by trial.")
+
+    # One search for the fixing row of every event
+    ts = df["time"].cast(pl.Int64).to_numpy()
+    fixing_rows = np.searchsorted(store.days.to_numpy(), ts // MS_IN_DAY)
+    quantity = df["quantity"].to_numpy()
+    ops = df["op"].cast(pl.String).to_list()
+    units = df["unit"].cast(pl.String).to_list()
+
+    # Group the trials by their sequence of (op, unit)
+    trial_ids, starts, counts = np.unique(
+        trial_col, return_index=True, return_counts=True
+    )
+    groups = {}
+    for trial, start, count in zip(trial_ids, starts, counts):
+        key = tuple(
+            zip(ops[start : start + count], units[start : start + count])
+        )
+        groups.setdefault(key, []).append((trial, start))
+
+    out_trial, out_index, out_value = [], [], []
+    for key, members in groups.items():
+        trials = np.array([trial for trial, _ in members])
+        rows = np.array([start for _, start in members])[:, None] + np.arange(
+            len(key)
+        )
+        group = TrialGroup(
+            trials,
+            rows,
+            [op for op, _ in key],
+            [unit for _, unit in key],
+            quantity,
+            fixing_rows,
+        )
+        values, emit = replay_group(group, expressions, base, store)
+        trial_idx, event_idx = np.nonzero(emit)
+        out_trial.append(trials[trial_idx])
+        out_index.append(event_idx)
+        out_value.append(values[trial_idx, event_idx])
+
+    table = pa.table(
+        {
+            "trial": np.concatenate(
+                [np.empty(0, np.int32)] + out_trial
+            ).astype(np.int32),
+            "index": np.concatenate(
+                [np.empty(0, np.uint64)] + out_index
+            ).astype(np.uint64),
+            "value": np.concatenate([np.empty(0)] + out_value),
+        }
+    )
+    return table.sort_by([("trial", "ascending"), ("index", "ascending")])
+
+
+def replay_group(group, expressions, base, store):
+    """Replay a group of trials. Return the values, and the mask of the emitted
+    events, both of shape (num_trials, num_events)."""
+    num_trials, num_events = group.rows.shape
+    exprs = [expressions[trial] for trial in group.trials]
+
+    # Forward, the value of each event and the conditions, if the contract is alive
+    values = np.zeros((num_trials, num_events))
+    conds = np.zeros((num_trials, num_events), dtype=bool)
+    for j, (op, unit) in enumerate(zip(group.ops, group.units)):
+        if op is None:
+            outputs = evaluate(group, exprs, unit, j, store, base)
+            for name, value in zip(exprs[0][unit]["out"], outputs):
+                group.state[name] = value
+            continue
+        values[:, j] = group.quantity[:, j] * resolve(
+            group, exprs, unit, j, store, base
+        )
+        if op != "+" and op not in CHOICE_OPS:
+            [cond] = evaluate(group, exprs, op, j, store, base)
+            conds[:, j] = cond
+
+    # Backward, the value of the rest of the contract after each event
+    rest = np.zeros((num_trials, num_events))
+    v = np.zeros(num_trials)
+    for j in reversed(range(num_events)):
+        op = group.ops[j]
+        rest[:, j] = v
+        if op == "+":
+            v = values[:, j] + v
+        elif op == ">":
+            v = np.maximum(values[:, j], v)
+        elif op == "<":
+            v = np.minimum(values[:, j], v)
+        elif op is not None:
+            v = np.where(conds[:, j], values[:, j], v)
+
+    # Forward, the cashflows until the contract terminates
+    alive = np.ones(num_trials, dtype=bool)
+    flows = np.zeros((num_trials, num_events))
+    emit = np.zeros((num_trials, num_events), dtype=bool)
+    for j, op in enumerate(group.ops):
+        if op is None:
+            continue
+        if op == "+":
+            flows[:, j] = np.where(alive, values[:, j], 0.0)
+            emit[:, j] = True
+            continue
+        if op == ">":
+            stop = rest[:, j] < values[:, j]
+        elif op == "<":
+            stop = rest[:, j] > values[:, j]
+        else:
+            stop = conds[:, j]
+        stop = alive & stop
+        flows[:, j] = np.where(stop, values[:, j], 0.0)
+        alive = alive & ~stop
+        emit[:, j] = group.quantity[:, j] != 0
+    return flows, emit
+
+
+def resolve(group, exprs, unit, j, store, base):
+    """Return the value of a unit at the j-th event, for each trial."""
+    if unit == base:
+        return np.ones(len(group.trials))
+    if unit in group.state:
+        return group.state[unit]
+    if unit in exprs[0]:
+        [value] = evaluate(group, exprs, unit, j, store, base)
+        return value
+    return fixing(group, unit, j, store)
+
+
+def fixing(group, unit, j, store):
+    """Return the fixing of a column of the spots at the j-th event."""
+    if unit not in store.data.columns:
+        raise ValueError(f"Unknown unit {unit}.")
+    rows = group.fixing_rows[:, j]
+    if np.any(rows >= len(store.days)):
+        raise ValueError(f"The events of {unit} are beyond the data.")
+    return store.values(unit)[rows]
+
+
+def evaluate(group, exprs, name, j, store, base):
+    """Evaluate the expression (phrase or snapper) at the j-th event, for each trial.
+    Return the list of outputs, each an array with a value per trial. The inputs are
+    resolved column-wise, and the function is called once if all the trials share
+    it, otherwise once per trial."""
+    inputs = [
+        resolve(group, exprs, inp, j, store, base)
+        for inp in exprs[0][name]["inp"]
+    ]
+    fns = [expr[name]["fn"] for expr in exprs]
+    if all(fn is fns[0] for fn in fns):
+        return [
+            np.broadcast_to(np.asarray(out, dtype=float), len(fns))
+            for out in fns[0](inputs)
+        ]
+
+    outputs = [
+        fn([value[i : i + 1] for value in inputs]) for i, fn in enumerate(fns)
+    ]
+    return [
+        np.array([np.asarray(out[k], dtype=float).item() for out in outputs])
+        for k in range(len(outputs[0]))
+    ]
@@ -0,0 +1,142 @@
+"""
+Samplers of the normal increments of the MC models, selected by the MC section of the
+dataset:
+    SAMPLING: "PSEUDO" (default) for pseudo random draws, or "SOBOL" for scrambled
+        Sobol sequences, with Brownian bridge ordering across the step times.
+    ANTITHETIC: True (default) to draw the paths in antithetic pairs.
+The default is the sampling of the finmc models, so the prices do not change.
+"""
+
+import warnings
+from math import sqrt
+
+import numpy as np
+from finmc.utils.mc import antithetic_normal
+from scipy.special import ndtri
+from scipy.stats import qmc
+
+from demo.src.model import TS_TO_YEARS
+
+SAMPLING_MODES = ("PSEUDO", "SOBOL")
+
+
+def step_times(timetable, dataset) -> list:
+    """Return the times (in years) of the steps of an MCFixedStep model, for the
+    events of a timetable. The Sobol sampler needs them before the simulation."""
+    pricing_ts = dataset["PRICING_TS"]
+    timestep = dataset["MC"]["TIMESTEP"]
+    ts = timetable["events"]["time"].cast("int64").to_numpy()
+    times = np.unique((ts - pricing_ts).astype(float) * TS_TO_YEARS)
+
+    # as MCFixedStep.advance
+    grid = []
+    cur_time = 0.0
+    for new_time in times:
+        while new_time > cur_time + timestep:
+            cur_time = cur_time + timestep
+            grid.append(cur_time)
+        if new_time > cur_time + 1e-10:
+            cur_time = float(new_time)
+            grid.append(cur_time)
+    return grid
+
+
+def brownian_bridge(times, z):
+    """Return the increments of Brownian paths on the times, built from the normals z
+    (one row per time) in Brownian bridge order: the first row sets the end of the
+    paths, the next rows the midpoints, so the first (best) Sobol dimensions drive
+    the largest moves."""
+    num_times = len(times)
+    t = np.concatenate([[0.0], times])
+    w = np.zeros((num_times + 1, z.shape[1]))
+    w[num_times] = sqrt(t[num_times]) * z[0]
+
+    k = 1
+    intervals = [(0, num_times)]
+    while intervals:
+        next_intervals = []
+        for left, right in intervals:
+            if right - left < 2:
+                continue
+            mid = (left + right) // 2
+            t_l, t_m, t_r = t[left], t[mid], t[right]
+            w[mid] = ((t_r - t_m) * w[left] + (t_m - t_l) * w[right]) / (
+                t_r - t_l
+            ) + sqrt((t_m - t_l) * (t_r - t_m) / (t_r - t_l)) * z[k]
+            k += 1
+            next_intervals += [(left, mid), (mid, right)]
+        intervals = next_intervals
+    return np.diff(w, axis=0)
+
+
+class PseudoSampler:
+    """Pseudo random normal increments, from the generator of the model."""
+
+    def __init__(self, rng, antithetic=True):
+        self.rng = rng
+        self.antithetic = antithetic
+
+    def draw(self, dt, out):
+        """Fill out with the normal increments for a step of dt."""
+        if self.antithetic:
+            antithetic_normal(self.rng, len(out), sqrt(dt), out)
+        else:
+            self.rng.standard_normal(out=out)
+            out *= sqrt(dt)
+
+    def skip(self):
+        """Move past a step whose paths were not simulated (e.g. were found in a
+        cache, with the state of the generator)."""
+
+
+class SobolSampler:
+    """Normal increments from a scrambled Sobol sequence, with one dimension per
+    step, mapped to the steps by a Brownian bridge. All the increments are generated
+    at once, so the steps of the simulation must be the given times."""
+
+    def __init__(self, times, n, seed=None, antithetic=True):
+        self.times = np.asarray(times, dtype=float)
+        if antithetic:
+            assert n % 2 == 0, "Number of paths must be even"
+        num_points = n // 2 if antithetic else n
+
+        sobol = qmc.Sobol(d=max(len(times), 1), scramble=True, seed=seed)
+        with warnings.catch_warnings():
+            # the balance properties need a power of 2 points
+            warnings.simplefilter("ignore", UserWarning)
+            u = sobol.random(num_points)
+        z = ndtri(u).T
+        if antithetic:
+            z = np.concatenate([z, -z], axis=1)
+        self.dw = brownian_bridge(self.times, z)
+        self.idx = 0
+
+    def draw(self, dt, out):
+        """Fill out with the normal increments for the next step, of dt."""
+        idx = self.idx
+        prev_time = self.times[idx - 1] if idx > 0 else 0.0
+        if (
+            idx >= len(self.times)
+            or abs(self.times[idx] - prev_time - dt) > 1e-9
+        ):
+            raise ValueError(
+                "The step is not on the times of the Sobol sampler."
+            )
+        out[:] = self.dw[idx]
+        self.idx += 1
+
+    def skip(self):
+        self.idx += 1
+
+
+def make_sampler(mc: dict, n: int, rng):
+    """Return the sampler selected by the MC section of the dataset, for n paths."""
+    sampling = mc.get("SAMPLING", "PSEUDO")
+    antithetic = bool(mc.get("ANTITHETIC", True))
+    if sampling == "PSEUDO":
+        return PseudoSampler(rng, antithetic)
+    if sampling == "SOBOL":
+        return SobolSampler(mc["TIMES"], n, mc.get("SEED"), antithetic)
+    raise ValueError(
+        f"Unknown sampling {sampling}, must be one of {SAMPLING_MODES}."
+    )
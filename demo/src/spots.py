@@ -0,0 +1,196 @@
+"""
+Process-wide store for the historical spots, shared by the data models.
+
+The spots csv is ingested into a typed Arrow IPC (feather) file next to it, tagged
+with the fingerprint of the csv. The store memory-maps that file while the fingerprint
+matches, and re-ingests the csv otherwise.
+"""
+
+import hashlib
+import os
+import sys
+import threading
+
+import numpy as np
+import polars as pl
+import pyarrow as pa
+
+MS_IN_DAY = 1000 * 3600 * 24
+SPOTS_FILE = "demo/data/spots.csv"
+CACHE_SUFFIX = ".arrow"
+FINGERPRINT_KEY = b"fingerprint"
+
+
+class SpotStore:
+    """Read-only spot history, loaded once per process. Assumes that there is a date
+    column and the data is sorted by the date column. The other columns are the units.
+    The data is shared by all callers, so it must not be modified in place."""
+
+    def __init__(self, data: pl.DataFrame, fingerprint: str):
+        self.data = data.set_sorted("date")
+        self.fingerprint = fingerprint
+        # polars stores dates as a day timestamp (days since epoch)
+        self.days = self.data["date"].cast(pl.Int64)
+        self._columns = {}
+        self._calendars = {}
+        self._schedules = {}
+
+    def values(self, unit) -> np.ndarray:
+        """Return the values of a unit as a read-only numpy array (nulls as nan)."""
+        values = self._columns.get(unit)
+        if values is None:
+            values = self.data[unit].to_numpy().copy()
+            values.flags.writeable = False
+            self._columns[unit] = values
+        return values
+
+    def trading_days(self, unit) -> np.ndarray:
+        """Return the trading calendar of a unit, i.e. the days (since epoch) on which
+        it has a value. The calendar is computed once per unit."""
+        days = self._calendars.get(unit)
+        if days is None:
+            valid = self.data.select(["date", unit]).drop_nulls()
+            days = valid["date"].cast(pl.Int64).to_numpy().copy()
+            days.flags.writeable = False
+            self._calendars[unit] = days
+        return days
+
+    def asof_ts(self, unit, ts) -> np.ndarray:
+        """Return the timestamps (ms) of the trading dates of a unit on or before each
+        of the given timestamps (ms), i.e. a backward as-of join against its calendar."""
+        days = self.trading_days(unit)
+        target_days = np.asarray(ts, dtype=np.int64) // MS_IN_DAY
+        idx = np.searchsorted(days, target_days, side="right") - 1
+        if len(idx) and idx.min() < 0:
+            raise ValueError(f"No valid date found for {unit} before {ts}")
+        return days[idx] * MS_IN_DAY
+
+    def schedule_ts(self, unit, start, end, freq="1mo") -> np.ndarray:
+        """Return the timestamps (ms) of the last trading date of a unit in each period
+        of the given frequency, e.g. "1mo" for month-ends or "1w" for week-ends,
+        between the start and end dates. The schedule is computed once per unit and
+        frequency."""
+        key = (unit, start, end, freq)
+        ts = self._schedules.get(key)
+        if ts is None:
+            # Period ends, as days since epoch
+            days = pl.date_range(start, end, "1d", eager=True)
+            ends = (
+                days.dt.truncate(freq).dt.offset_by(freq).dt.offset_by("-1d")
+            )
+            ends = ends.filter((ends >= days[0]) & (ends <= days[-1])).unique(
+                maintain_order=True
+            )
+            ends = ends.cast(pl.Int64).to_numpy()
+
+            ts = self.asof_ts(unit, ends * MS_IN_DAY)
+            ts.flags.writeable = False
+            self._schedules[key] = ts
+        return ts
+
+
+def spots_schema(filename) -> dict:
+    """Return the explicit schema of the spots csv, a date column and a float column
+    for each unit in the header. With an explicit schema the csv reader does not
+    need to scan the whole file to infer the types."""
+    with open(filename) as f:
+        header = f.readline().strip().split(",")
+    return {col: pl.Date if col == "date" else pl.Float64 for col in header}
+
+
+def fingerprint(filename) -> str:
+    """Return the fingerprint (sha256) of the contents of a file."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(filename) -> str:
+    """Return the path of the columnar cache for a spots csv."""
+    return os.path.splitext(filename)[0] + CACHE_SUFFIX
+
+
+def read_spots(filename) -> pl.DataFrame:
+    """Read the spots csv file using the explicit schema."""
+    return pl.read_csv(filename, schema=spots_schema(filename))
+
+
+def ingest_spots(filename=SPOTS_FILE, fp=None) -> str:
+    """Convert the spots csv into a typed Arrow IPC file, tagged with the fingerprint
+    of the csv. The file is written atomically, so that concurrent readers never see
+    a partial file. Return the path of the cache file."""
+    if fp is None:
+        fp = fingerprint(filename)
+    table = read_spots(filename).to_arrow()
+    table = table.replace_schema_metadata({FINGERPRINT_KEY: fp})
+
+    path = cache_path(filename)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with pa.OSFile(tmp_path, "wb") as sink:
+        writer = pa.ipc.new_file(sink, table.schema)
+        writer.write_table(table)
+        writer.close()
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_cache(filename, fp):
+    """Return the memory-mapped spots from the cache file, or None if the cache
+    is missing, unreadable or its fingerprint does not match."""
+    try:
+        reader = pa.ipc.open_file(pa.memory_map(cache_path(filename)))
+    except (OSError, pa.ArrowInvalid):
+        return None
+    metadata = reader.schema.metadata or {}
+    if metadata.get(FINGERPRINT_KEY) != fp.encode():
+        return None
+    return pl.from_arrow(reader.read_all())
+
+
+def load_spots(filename=SPOTS_FILE) -> SpotStore:
+    """Load the spots from the columnar cache, (re)ingesting the csv if the cache is
+    stale. If the cache cannot be written (e.g. a read-only deployment), fall back to
+    reading the csv."""
+    fp = fingerprint(filename)
+    data = read_cache(filename, fp)
+    if data is None:
+        try:
+            ingest_spots(filename, fp)
+            data = read_cache(filename, fp)
+        except OSError:
+            pass
+    if data is None:
+        data = read_spots(filename)
+    return SpotStore(data, fp)
+
+
+_stores = {}
+_lock = threading.Lock()
+
+
+def get_store(filename=SPOTS_FILE) -> SpotStore:
+    """Return the spot store for a file, loading the file only on first use.
+    When the app is preloaded (gunicorn --preload), the store is loaded before the
+    workers are forked, and its pages are shared by all the workers."""
+    key = os.path.realpath(filename)
+    store = _stores.get(key)
+    if store is None:
+        with _lock:
+            store = _stores.get(key)
+            if store is None:
+                store = load_spots(filename)
+                _stores[key] = store
+    return store
+
+
+def clear_stores():
+    """Drop all loaded stores, e.g. after the data files have been updated."""
+    with _lock:
+        _stores.clear()
+
+
+if __name__ == "__main__":
+    # Ingest step: python -m demo.src.spots [csv file]
+    print(ingest_spots(*sys.argv[1:2]))
@@ -2,12 +2,13 @@
 Create timetables for different contracts, using the contract parameters dict.
 """
 
-import polars as pl
+import numpy as np
 import pyarrow as pa
 from qablet_contracts.eq.autocall import DiscountCert, ReverseCB
 from qablet_contracts.eq.barrier import OptionKO
 from qablet_contracts.eq.cliquet import Accumulator
 from qablet_contracts.eq.vanilla import Option
+from qablet_contracts.ir.dcf import dcf_30_360 as dcf
 from qablet_contracts.timetable import TS_EVENT_SCHEMA
 
 CONTRACT_TYPES = [
@@ -18,6 +19,38 @@ CONTRACT_TYPES = [
     "Cliquet",
 ]
 
+TICKERS = ["SPX", "EUR", "BTC", "FTSE"]
+
+# Terms of the contracts, shared by create_timetable and create_timetables.
+NOTIONAL = 100.0  # of the notes and the cliquet
+DC_CPN_RATE = 0.17  # coupon rate of the discount certificate
+RC_CPN_RATE = 0.15  # coupon rate of the reverse convertible
+KO_BARRIER = 1.2  # barrier of the knockout option, relative to the spot
+KO_REBATE = 0.01  # rebate of the knockout option, relative to the spot
+
+# The contract parameters used by each contract type, besides ticker and ctr-type.
+CONTRACT_TERMS = {
+    "Discount Certificate": ("strike",),
+    "Reverse Convertible": ("strike",),
+    "Knockout Option": ("option_type", "strike"),
+    "Vanilla Option": ("option_type", "strike"),
+    "Cliquet": ("floor_cap",),
+}
+
+
+def contract_terms(params):
+    """Return the contract parameters without those that the contract type does not
+    use, so that the same contract has the same parameters (and cached results),
+    e.g. a cliquet does not depend on the strike. The floor and cap are rounded to
+    the 0.1 step of the editor, as floats."""
+    contract_type = params["ctr-type"]
+    terms = {"ticker": params["ticker"], "ctr-type": contract_type}
+    for name in CONTRACT_TERMS[contract_type]:
+        terms[name] = params[name]
+    if "floor_cap" in terms:
+        terms["floor_cap"] = [round(float(v), 1) for v in terms["floor_cap"]]
+    return terms
+
 
 def create_timetable(monthend_datetimes, spot, trial, params):
     """Create the timetable for the contract."""
@@ -56,7 +89,6 @@ def create_autocallable_timetable(monthend_datetimes, spot, trial, params):
     m_per = 3
     m_exp = 12
     barrier_dts = monthend_datetimes[trial + m_per : trial + m_exp + 1 : m_per]
-    cpn_rate = 0.17
     accrual_start = monthend_datetimes[trial]
 
     return DiscountCert(
@@ -68,7 +100,8 @@ def create_autocallable_timetable(monthend_datetimes, spot, trial, params):
         maturity=barrier_dts[-1],
         barrier=100,
         barrier_dates=barrier_dts,
-        cpn_rate=cpn_rate,
+        cpn_rate=DC_CPN_RATE,
+        notional=NOTIONAL,
     )
 
 
@@ -80,7 +113,6 @@ def create_reverse_cb_timetable(monthend_datetimes, spot, trial, params):
     m_per = 3
     m_exp = 12
     barrier_dts = monthend_datetimes[trial + m_per : trial + m_exp + 1 : m_per]
-    cpn_rate = 0.15
     accrual_start = monthend_datetimes[trial]
 
     return ReverseCB(
@@ -92,7 +124,8 @@ def create_reverse_cb_timetable(monthend_datetimes, spot, trial, params):
         maturity=barrier_dts[-1],
         barrier=100,
         barrier_dates=barrier_dts,
-        cpn_rate=cpn_rate,
+        cpn_rate=RC_CPN_RATE,
+        notional=NOTIONAL,
     )
 
 
@@ -110,10 +143,10 @@ def create_barrier_timetable(monthend_datetimes, spot, trial, params):
         strike=params.get("strike", 100) * spot / 100,
         maturity=barrier_dts[-1],
         is_call=params["option_type"] == "Call",
-        barrier=spot * 1.2,
+        barrier=spot * KO_BARRIER,
         barrier_type="Up/Out",
         barrier_dates=barrier_dts,
-        rebate=spot * 0.01,
+        rebate=spot * KO_REBATE,
     )
 
 
@@ -151,16 +184,187 @@ def create_cliquet_timetable(monthend_datetimes, spot, trial, params):
         global_floor=0.0,
         local_cap=cap / 100,
         local_floor=floor / 100,
+        notional=NOTIONAL,
+    )
+
+
+class TimetableBatch:
+    """The timetables of a contract for many trade dates (trials), with the events of
+    all the trials in one record batch. The timetable of a trial is a zero-copy
+    slice of it. The expressions are created on first use, per trial."""
+
+    def __init__(
+        self, events, offsets, monthend_datetimes, trials, spots, params
+    ):
+        self.events = events  # pa.RecordBatch, with TS_EVENT_SCHEMA
+        self.offsets = offsets  # trial i has the rows offsets[i]:offsets[i+1]
+        self.monthend_datetimes = monthend_datetimes
+        self.trials = trials
+        self.spots = spots
+        self.params = params
+        self._expressions = {}
+
+    def __len__(self):
+        return len(self.trials)
+
+    def table(self) -> pa.Table:
+        """Return the events with a trial column (the position in the batch)."""
+        counts = np.diff(self.offsets)
+        trial = np.repeat(np.arange(len(self), dtype=np.int32), counts)
+        return pa.Table.from_batches(
+            [self.events.append_column("trial", pa.array(trial))]
+        )
+
+    def expressions(self, i) -> dict:
+        """Return the expressions of the i-th trial of the batch."""
+        if i not in self._expressions:
+            self._expressions[i] = create_timetable(
+                self.monthend_datetimes,
+                self.spots[i],
+                self.trials[i],
+                self.params,
+            ).expressions()
+        return self._expressions[i]
+
+    def timetable(self, i) -> dict:
+        """Return the timetable of the i-th trial of the batch."""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {
+            "events": self.events.slice(start, end - start),
+            "expressions": self.expressions(i),
+        }
+
+
+def create_timetables(monthend_datetimes, spots, trials, params):
+    """Create the timetables of the contract for the trials (positions in
+    monthend_datetimes), with spots the spot on each trade date, in one batch.
+    The events are the same as those of create_timetable for each trial, but they
+    are built column-wise, without creating the contract objects."""
+    contract_type = params["ctr-type"]
+    trials = np.asarray(trials)
+    spots = np.asarray(spots, dtype=float)
+    ts = np.array(
+        [int(dt.timestamp() * 1000) for dt in monthend_datetimes],
+        dtype=np.int64,
+    )
+    ticker = params["ticker"]
+
+    def dates(m_per, m_exp):
+        """Positions of the dates of each trial, as in the timetable functions."""
+        return trials[:, None] + np.arange(m_per, m_exp + 1, m_per)
+
+    def accrual(end_idx, start_idx):
+        """Daycount fractions between positions in monthend_datetimes."""
+        return np.vectorize(
+            lambda e, s: dcf(monthend_datetimes[e], monthend_datetimes[s])
+        )(end_idx, start_idx)
+
+    def option(strike, is_call):
+        sign = 1 if is_call else -1
+        slots = [(">", "USD", ""), ("+", "USD", ""), ("+", ticker, "")]
+        quantity = np.column_stack(
+            [np.zeros(len(trials)), -strike * sign, np.full(len(trials), sign)]
+        )
+        return slots, quantity
+
+    if contract_type in ("Discount Certificate", "Reverse Convertible"):
+        idx = dates(3, 12)
+        times = ts[np.column_stack([idx, idx[:, -1]])]
+        if contract_type == "Discount Certificate":
+            slots = [("call", "USD", "")] * 4
+            cpn = NOTIONAL * np.exp(
+                accrual(idx, trials[:, None]) * DC_CPN_RATE
+            )
+            quantity = cpn
+        else:
+            slots = [("+", "USD", ""), ("call", "USD", "")] * 4
+            starts = np.column_stack([trials, idx[:, :-1]])
+            cpn = NOTIONAL * accrual(idx, starts) * RC_CPN_RATE
+            quantity = np.stack([cpn, np.full_like(cpn, NOTIONAL)], axis=2)
+            quantity = quantity.reshape(len(trials), -1)
+            times = ts[
+                np.column_stack([np.repeat(idx, 2, axis=1), idx[:, -1]])
+            ]
+        slots = slots + [("+", "payoff", "")]
+        quantity = np.column_stack([quantity, np.ones(len(trials))])
+    elif contract_type == "Knockout Option":
+        idx = dates(1, 12)
+        strike = params.get("strike", 100) * spots / 100
+        opt_slots, opt_quantity = option(
+            strike, params["option_type"] == "Call"
+        )
+        slots = [("ko", "USD", "")] * 12 + opt_slots
+        quantity = np.column_stack(
+            [np.repeat(spots[:, None] * KO_REBATE, 12, axis=1), opt_quantity]
+        )
+        times = ts[np.column_stack([idx] + [idx[:, -1]] * 3)]
+    elif contract_type == "Vanilla Option":
+        idx = dates(3, 12)
+        strike = params.get("strike", 100) * spots / 100
+        slots, quantity = option(strike, params["option_type"] == "Call")
+        times = ts[np.column_stack([idx[:, -1]] * 3)]
+    elif contract_type == "Cliquet":
+        idx = dates(1, 12)
+        slots = [(None, "start", None)] + [(None, "addfix", None)] * 11
+        slots = slots + [(">", "USD", ""), ("+", "ACC", "")]
+        quantity = np.zeros((len(trials), 14))
+        quantity[:, 13] = NOTIONAL
+        times = ts[np.column_stack([idx] + [idx[:, -1]] * 2)]
+    else:
+        raise ValueError(f"Unknown contract type: {contract_type}")
+
+    events = pa.RecordBatch.from_arrays(
+        [
+            pa.array(times.ravel(), type=TS_EVENT_SCHEMA.field("time").type),
+            dictionary_column([op for op, _, _ in slots], len(trials)),
+            pa.array(quantity.ravel(), type=pa.float64()),
+            dictionary_column([unit for _, unit, _ in slots], len(trials)),
+            dictionary_column([track for _, _, track in slots], len(trials)),
+        ],
+        schema=TS_EVENT_SCHEMA,
+    )
+    offsets = np.arange(len(trials) + 1) * len(slots)
+    return TimetableBatch(
+        events, offsets, monthend_datetimes, trials, spots, params
+    )
+
+
+def dictionary_column(values, repeat):
+    """Return a dictionary array with the values (strings or None), repeated."""
+    dictionary = sorted({v for v in values if v is not None})
+    codes = np.array(
+        [dictionary.index(v) if v is not None else 0 for v in values]
+    )
+    mask = np.array([v is None for v in values])
+    return pa.DictionaryArray.from_arrays(
+        np.tile(codes, repeat).astype(np.int64),
+        pa.array(dictionary, type=pa.string()),
+        mask=np.tile(mask, repeat) if mask.any() else None,
     )
 
 
 def extend_timetable(tt1, tt2):
     """Extend the tt1 with new events, in place.
-    Assume that all events in tt2 are after the last event in tt1."""
-    df1 = pl.from_arrow(tt1["events"])
-    df2 = pl.from_arrow(tt2["events"])
-    df1.extend(df2)
-    tt1["events"] = df1.to_arrow().to_batches()[0].cast(TS_EVENT_SCHEMA)
+    All events in tt2 must be on or after the last event in tt1. The batches are
+    concatenated in arrow, which unifies the dictionaries of the columns, since the
+    pricer needs a single record batch."""
+    events1, events2 = tt1["events"], tt2["events"]
+    ts = events2["time"].cast("int64").to_numpy()
+    if events1.num_rows:
+        ts = np.concatenate([[events1["time"][-1].value], ts])
+    if np.any(np.diff(ts) < 0):
+        raise ValueError("The new events must be sorted, after the timetable.")
+    batches = (
+        pa.Table.from_batches([events1, events2.cast(TS_EVENT_SCHEMA)])
+        .combine_chunks()
+        .to_batches()
+    )
+    # a table without rows has no batches
+    tt1["events"] = (
+        batches[0]
+        if batches
+        else pa.RecordBatch.from_pylist([], schema=TS_EVENT_SCHEMA)
+    )
 
 
 def create_forward_timetable(end_dt, params):
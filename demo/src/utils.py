@@ -2,22 +2,155 @@
 This module contains utility functions for the demo.
 """
 
+import multiprocessing
 import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
-from scipy.optimize import minimize_scalar
 
 ROOTDIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 
+# Adaptive MC (see demo.src.mc.run_batches): target standard error of the price,
+# relative to the price, and time budget in seconds. Unset runs a fixed number of paths.
+MC_TOL = os.environ.get("MC_TOL")
+MC_BUDGET = os.environ.get("MC_BUDGET")
+# Sampling of the MC (see demo.src.sampling): PSEUDO or SOBOL, and antithetic pairs.
+MC_SAMPLING = os.environ.get("MC_SAMPLING", "PSEUDO")
+MC_ANTITHETIC = os.environ.get("MC_ANTITHETIC", "1") == "1"
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+def get_executor(workers=None) -> ProcessPoolExecutor:
+    """Return a pool of processes with the given number of workers (default: one per
+    cpu). The pool is created on first use, and reused by all later calls.
+    The workers are spawned rather than forked, since forking a process after polars
+    has started its thread pool can deadlock."""
+    if workers is None:
+        workers = os.cpu_count()
+    with _executors_lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            _executors[workers] = executor
+    return executor
+
 
 # IRR
-def loss_irr(
-    ytm: float, payments: np.ndarray, times: np.ndarray, price: float
-) -> float:
-    df = np.exp(-ytm * times)
-    pv = np.dot(payments, df)
-    err = pv - price
-    return 0.5 * err * err
+IRR_BOUND = 64.0  # Largest IRR magnitude searched, larger values overflow exp
+
+
+def solve_irr(
+    payments: np.ndarray,
+    times: np.ndarray,
+    offsets: np.ndarray,
+    prices: np.ndarray,
+    tol: float = 1e-12,
+    max_iter: int = 100,
+):
+    """Solve for the (continuously compounded) IRR of many trials at once.
+    The payments and times of all trials are concatenated, trial k owns the slice
+    offsets[k]:offsets[k+1]. The root of pv(y) - price is first bracketed, then found
+    with Newton steps, falling back to bisection whenever a step leaves the bracket.
+    Return the irr and the converged flag of each trial. The irr is nan for a trial
+    that did not converge, e.g. when no root is bracketed within +/- IRR_BOUND."""
+    payments = np.asarray(payments, dtype=np.float64)
+    times = np.asarray(times, dtype=np.float64)
+    prices = np.asarray(prices, dtype=np.float64)
+    n = len(prices)
+    trial = np.repeat(np.arange(n), np.diff(offsets))
+
+    def err(y):
+        """pv - price and its derivative, for the irr y of each trial."""
+        disc = payments * np.exp(-y[trial] * times)
+        pv = np.bincount(trial, weights=disc, minlength=n)
+        dpv = np.bincount(trial, weights=-times * disc, minlength=n)
+        return pv - prices, dpv
+
+    # Bracket the root, expanding the interval until the error changes sign
+    lo = np.full(n, -1.0)
+    hi = np.full(n, 1.0)
+    f_lo, _ = err(lo)
+    f_hi, _ = err(hi)
+    while True:
+        open_ = (np.sign(f_lo) == np.sign(f_hi)) & (hi < IRR_BOUND)
+        if not open_.any():
+            break
+        lo[open_] *= 2
+        hi[open_] *= 2
+        f_lo, _ = err(lo)
+        f_hi, _ = err(hi)
+    bracketed = np.sign(f_lo) != np.sign(f_hi)
+
+    # Safeguarded Newton iterations, all trials at once
+    y = np.clip(np.zeros(n), lo, hi)
+    converged = bracketed & ((f_lo == 0) | (f_hi == 0))
+    y[converged & (f_lo == 0)] = lo[converged & (f_lo == 0)]
+    y[converged & (f_hi == 0)] = hi[converged & (f_hi == 0)]
+    scale = np.maximum(np.abs(prices), 1.0)
+    for _ in range(max_iter):
+        active = bracketed & ~converged
+        if not active.any():
+            break
+        f, df = err(y)
+        done = active & (np.abs(f) <= tol * scale)
+        converged |= done
+        active &= ~done
+
+        # shrink the bracket, keeping the sign change inside
+        same_as_lo = np.sign(f) == np.sign(f_lo)
+        lo = np.where(active & same_as_lo, y, lo)
+        f_lo = np.where(active & same_as_lo, f, f_lo)
+        hi = np.where(active & ~same_as_lo, y, hi)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            y_newton = y - f / df
+        inside = (y_newton > lo) & (y_newton < hi)
+        y = np.where(active, np.where(inside, y_newton, (lo + hi) / 2), y)
+        converged |= active & (hi - lo <= tol * (1 + np.abs(y)))
+
+    return np.where(converged, y, np.nan), converged
+
+
+def compute_returns(
+    payments: list,
+    times: list,
+    prices: np.ndarray,
+    annualized: bool = True,
+):
+    """Compute the returns of many trials at once, given the list of payments and the
+    list of times (in years) of each trial, and the price of each trial.
+    Return the returns and the converged flag of each trial."""
+    offsets = np.cumsum([0] + [len(p) for p in payments])
+    flat_payments = np.concatenate([np.empty(0)] + list(payments))
+    flat_times = np.concatenate([np.empty(0)] + list(times))
+    return flat_returns(
+        flat_payments, flat_times, offsets, prices, annualized=annualized
+    )
+
+
+def flat_returns(
+    payments: np.ndarray,
+    times: np.ndarray,
+    offsets: np.ndarray,
+    prices: np.ndarray,
+    annualized: bool = True,
+):
+    """Compute the returns of many trials at once, as compute_returns, with the
+    payments and times of all trials concatenated, as in solve_irr.
+    Return the returns and the converged flag of each trial."""
+    prices = np.asarray(prices, dtype=np.float64)
+    if not annualized:
+        trial = np.repeat(np.arange(len(prices)), np.diff(offsets))
+        totals = np.bincount(trial, weights=payments, minlength=len(prices))
+        returns = totals / prices - 1
+        return returns, np.ones(len(prices), dtype=bool)
+    return solve_irr(payments, times, offsets, prices)
 
 
 def compute_return(
@@ -26,29 +159,33 @@ def compute_return(
     price: float,
     annualized: bool = True,
 ) -> float:
-    if not annualized:
-        return payments.sum() / price - 1
-    try:
-        res = minimize_scalar(fun=loss_irr, args=(payments, times, price))
-        if res.success:
-            return res.x
-        else:
-            raise ValueError(f"Optimization failed: {res.message}")
-    except Exception:
+    """Compute the return of a single trial, None if the irr did not converge."""
+    returns, converged = compute_returns(
+        [payments], [times], [price], annualized=annualized
+    )
+    if not converged[0]:
         return None
+    return returns[0]
 
 
 def base_dataset():
     """Create the base dataset. Asset data and model parameters will be
     added later, specific to each pricing date."""
-    return {
+    dataset = {
         "MC": {
             "PATHS": 10_000,
             "TIMESTEP": 100,  # BSM doesn't need small timesteps
             "SEED": 1,
+            "SAMPLING": MC_SAMPLING,
+            "ANTITHETIC": MC_ANTITHETIC,
         },
         "BASE": "USD",
     }
+    if MC_TOL is not None:
+        dataset["MC"]["TOL"] = float(MC_TOL)
+    if MC_BUDGET is not None:
+        dataset["MC"]["BUDGET"] = float(MC_BUDGET)
+    return dataset
 
 
 def dataset_assets(spot, params):
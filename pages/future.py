@@ -3,8 +3,11 @@ This page shows future returns projected by model.
 """
 
 import dash
-from dash import Input, Output, callback, dcc, html
-from demo.src.future_cf import model_cashflows, vol_risk
+import numpy as np
+from dash import Input, Output, callback, dcc, html, set_props
+from dash.exceptions import PreventUpdate
+from demo.src.future_cf import COARSE_PATHS, vol_scenarios
+from demo.src.jobs import stop_if_superseded
 from demo.src.plots.backtest_plots import blank_figure
 from demo.src.plots.future_plots import plot_cf_vs_spot, plot_price_vol
 
@@ -46,6 +49,17 @@ layout = html.Div(
         html.Div(
             [
                 html.P("Model Price vs Volatility"),
+                html.Div(
+                    [
+                        html.Span(id="future-progress"),
+                        html.Button(
+                            "Cancel",
+                            id="future-cancel",
+                            disabled=True,
+                            style={"margin-left": "10px"},
+                        ),
+                    ]
+                ),
                 dcc.Graph(
                     id="future-vol-plot",
                     figure=blank_figure(),
@@ -58,6 +72,8 @@ layout = html.Div(
                 "width": "20%",
             },
         ),
+        # The scenarios for all the vols, computed once per contract.
+        dcc.Store(id="future-scenarios", storage_type="session"),
     ],
 )
 
@@ -65,19 +81,28 @@ layout = html.Div(
 @callback(
     Output("future-returns", "figure"),
     Output("markdown-output", "children"),
-    Input("ctr-params", "data"),
+    Input("future-scenarios", "data"),
     Input("future-vol-plot", "clickData"),
 )
-def update_future_returns(contract_params, click_data):
-    """Generate cashflows from model and plot returns."""
+def update_future_returns(scenarios, click_data):
+    """Plot returns for the selected vol, from the precomputed scenarios."""
+
+    if scenarios is None:
+        raise PreventUpdate
 
     if click_data is None:
         vol = 0.2
     else:
         vol = click_data["points"][0]["x"]
 
-    cfsums, spot = model_cashflows(contract_params, vol=vol)
-    fig = plot_cf_vs_spot(cfsums, spot, vol, params=contract_params)
+    # The scenario closest to the selected vol
+    idx = int(np.argmin(np.abs(np.array(scenarios["vols"]) - vol)))
+    vol = scenarios["vols"][idx]
+    cfsums = [np.array(cf) for cf in scenarios["cashflows"][idx]]
+    contract_params = scenarios["params"]
+    fig = plot_cf_vs_spot(
+        cfsums, scenarios["spot"], vol, params=contract_params
+    )
 
     markdown_content = f"Contract Cashflows vs Spot Returns at **{vol * 100:.1f}% volatility.**"
     return fig, dcc.Markdown(markdown_content)
@@ -85,12 +110,30 @@ def update_future_returns(contract_params, click_data):
 
 @callback(
     Output("future-vol-plot", "figure"),
+    Output("future-scenarios", "data"),
     Input("ctr-params", "data"),
+    background=True,
+    progress=Output("future-progress", "children"),
+    progress_default="",
+    running=[(Output("future-cancel", "disabled"), False, True)],
+    cancel=Input("future-cancel", "n_clicks"),
 )
-def update_future_vol(contract_params):
-    """Plot Price vs Volatility."""
+def update_future_vol(set_progress, contract_params):
+    """Compute the scenarios for all the vols, and plot Price vs Volatility.
+    This runs as a background job (see demo.src.jobs), can be cancelled, and stops
+    between batches when a newer job supersedes it. The
+    prices are plotted first with COARSE_PATHS per vol, then with all the paths."""
+
+    def progress(ladder):
+        stop_if_superseded()
+        set_progress(f"Refining the prices of {ladder['paths']} paths.")
+        fig = plot_price_vol(ladder["vols"], ladder["prices"], ladder["se"])
+        set_props("future-vol-plot", {"figure": fig})
 
-    vols, prices = vol_risk(contract_params)
-    fig = plot_price_vol(vols, prices)
+    set_progress("Simulating the scenarios.")
+    scenarios = vol_scenarios(
+        contract_params, coarse_paths=COARSE_PATHS, progress=progress
+    )
+    fig = plot_price_vol(scenarios["vols"], scenarios["prices"])
 
-    return fig
+    return fig, {**scenarios, "params": contract_params}
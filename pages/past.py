@@ -2,14 +2,42 @@
 This page demonstrates backtesting a given contract type, and show IRR and cashflow.
 """
 
+import os
+import time
+
 import dash
-from dash import Input, Output, callback, dcc, html
+import numpy as np
+from dash import (
+    ClientsideFunction,
+    Input,
+    Output,
+    State,
+    callback,
+    clientside_callback,
+    dcc,
+    html,
+    set_props,
+)
 from dash.exceptions import PreventUpdate
-from demo.src.backtest import run_backtest
-from demo.src.plots.backtest_plots import blank_figure, plot_cashflow, plot_irr
+from demo.src.backtest import is_annualized, run_backtest
+from demo.src.jobs import props_delivered, stop_if_superseded
+from demo.src.payloads import get_trial, put_payload
+from demo.src.plots.backtest_plots import (
+    blank_figure,
+    cashflow_figure_data,
+    plot_cashflow,
+    plot_irr,
+)
 
 dash.register_page(__name__)
 
+# If set, the cashflow plot is drawn in the browser (assets/past_cashflow.js), from
+# data sent once with the IRR plot, and hovering never calls the server.
+CLIENTSIDE_CASHFLOW = os.environ.get("CLIENTSIDE_CASHFLOW", "0") == "1"
+
+# Seconds between the plots of the returns priced so far, while the backtest runs.
+PARTIAL_PLOT_SECONDS = 0.5
+
 
 layout = html.Div(
     [
@@ -19,6 +47,17 @@ layout = html.Div(
                 html.P(
                     "Historical Returns for Trade Dates between Dec'19-Apr'24."
                 ),
+                html.Div(
+                    [
+                        html.Span(id="past-progress"),
+                        html.Button(
+                            "Cancel",
+                            id="past-cancel",
+                            disabled=True,
+                            style={"margin-left": "10px"},
+                        ),
+                    ]
+                ),
                 dcc.Graph(
                     id="past-irr",
                     figure=blank_figure(),
@@ -33,6 +72,7 @@ layout = html.Div(
             style={"display": "inline-block", "width": "95%"},
         ),
         dcc.Store(id="past-data", storage_type="session"),
+        dcc.Store(id="past-cf-data"),
     ],
     style={
         "position": "fixed",
@@ -46,19 +86,64 @@ layout = html.Div(
 @callback(
     Output("past-irr", "figure"),
     Output("past-data", "data"),
+    Output("past-cf-data", "data"),
     Input("ctr-params", "data"),
+    background=True,
+    progress=Output("past-progress", "children"),
+    progress_default="",
+    running=[(Output("past-cancel", "disabled"), False, True)],
+    cancel=Input("past-cancel", "n_clicks"),
 )
-def update_past_irr(contract_params):
+def update_past_irr(set_progress, contract_params):
     """Run the backtest and plot the returns for each trade date.
-    The hover in this plot triggers the cashflow plot."""
+    This runs as a background job (see demo.src.jobs), which can be cancelled, and
+    stops between trade dates when a newer job supersedes it. The returns are
+    plotted as they are solved (by batch of trade dates), every
+    PARTIAL_PLOT_SECONDS: the first ones in a new figure, then only the new points,
+    as a Patch of the figure.
+    The hover in this plot triggers the cashflow plot. The cashflows are kept on
+    the server, the browser only holds their key, unless the cashflow plot is drawn
+    in the browser."""
+
+    annualized = is_annualized(contract_params)
+    last_plot = [float("-inf")]  # plot the first results at once
+    plotted = [0]  # number of results in the figure
 
-    annualized = contract_params["ctr-type"] in [
-        "Discount Certificate",
-        "Reverse Convertible",
-    ]
+    def progress(results, total, priced):
+        stop_if_superseded()
+        set_progress(f"Priced {priced} of {total} trade dates.")
+        if time.monotonic() - last_plot[0] < PARTIAL_PLOT_SECONDS:
+            return
+        if len(results) == plotted[0] or not props_delivered():
+            return  # the new points are sent with the next ones
+        start = plotted[0]
+        dates = [r["date"] for r in results[start:]]
+        irr = np.array([r["irr"] for r in results[start:]])
+        if start == 0:
+            fig = plot_irr(
+                dates,
+                irr,
+                annualized=annualized,
+                ticker=contract_params["ticker"],
+            )
+        else:
+            fig = dash.Patch()
+            scatter, histogram = fig["data"][0], fig["data"][1]
+            scatter["x"].extend(dates)
+            scatter["y"].extend(irr.tolist())
+            scatter["customdata"].extend(list(range(start, len(results))))
+            scatter["marker"]["color"].extend(
+                np.where(irr < 0, "coral", "aquamarine").tolist()
+            )
+            histogram["y"].extend(irr.tolist())
+        set_props("past-irr", {"figure": fig})
+        plotted[0] = len(results)
+        last_plot[0] = time.monotonic()
 
     df, stats = run_backtest(
-        contract_params=contract_params, annualized=annualized
+        contract_params=contract_params,
+        annualized=annualized,
+        progress=progress,
     )
 
     fig1 = plot_irr(
@@ -68,20 +153,40 @@ def update_past_irr(contract_params):
         ticker=contract_params["ticker"],
     )
 
-    return fig1, stats
+    if CLIENTSIDE_CASHFLOW:
+        return fig1, dash.no_update, cashflow_figure_data(stats)
+    return fig1, {"key": put_payload(stats)}, dash.no_update
 
 
-@callback(
-    Output("past-cf", "figure"),
-    Input("past-irr", "hoverData"),
-    Input("past-data", "data"),
-)
-def update_past_cashflow(hoverData, stats):
+def update_past_cashflow(hoverData, past_data, contract_params):
     """Plot the cashflow of the selected trade date."""
 
     idx = hoverData["points"][0].get("customdata")
-    if idx is None:
+    if idx is None or past_data is None:
         raise PreventUpdate
-    return plot_cashflow(
-        stats["ts"][idx], stats["stats"][idx], stats["ticker"]
+
+    trial = get_trial(past_data["key"], idx)
+    if trial is None:
+        # The payload was evicted, store it again from the (cached) backtest
+        _, stats = run_backtest(
+            contract_params=contract_params,
+            annualized=is_annualized(contract_params),
+        )
+        trial = get_trial(put_payload(stats), idx)
+    return plot_cashflow(*trial)
+
+
+if CLIENTSIDE_CASHFLOW:
+    clientside_callback(
+        ClientsideFunction(namespace="past", function_name="plot_cashflow"),
+        Output("past-cf", "figure"),
+        Input("past-irr", "hoverData"),
+        Input("past-cf-data", "data"),
     )
+else:
+    callback(
+        Output("past-cf", "figure"),
+        Input("past-irr", "hoverData"),
+        Input("past-data", "data"),
+        State("ctr-params", "data"),
+    )(update_past_cashflow)
@@ -0,0 +1,40 @@
+"""
+Fixtures shared by the tests.
+"""
+
+import os
+import tempfile
+
+import pytest
+
+# The tests never read or write the cache and the bundle of the app, so that the
+# results they check are computed in each run. Set before demo.src.cache is imported.
+_cache_dir = tempfile.TemporaryDirectory(prefix="demo-tests-")
+os.environ["DEMO_CACHE_DIR"] = _cache_dir.name
+os.environ["DEMO_BUNDLE"] = os.path.join(_cache_dir.name, "bundle.parquet")
+
+
+@pytest.fixture
+def pricing_setup():
+    """Return a function that creates the timetable of a contract on SPX, traded on
+    the first month end, and the dataset to price it with a flat local vol."""
+
+    from demo.src.model import DataModel
+    from demo.src.timetables import create_timetable
+    from demo.src.utils import base_dataset, dataset_assets
+
+    def setup(contract_params, vol=0.3):
+        csvdata = DataModel()
+        monthend_datetimes = csvdata.monthend_datetimes("SPX")
+        spot = csvdata.get_value("SPX", monthend_datetimes[0])
+
+        dataset = base_dataset()
+        dataset["PRICING_TS"] = int(monthend_datetimes[0].timestamp() * 1000)
+        dataset["ASSETS"] = dataset_assets(spot, contract_params)
+        dataset["LV"] = {"ASSET": "SPX", "VOL": vol}
+        timetable = create_timetable(
+            monthend_datetimes, spot, 0, contract_params
+        ).timetable()
+        return timetable, dataset
+
+    return setup
@@ -0,0 +1,49 @@
+"""
+Script to test the adaptive MC without launching the app.
+"""
+
+import pytest
+from demo.src.mc import CachedLVMC, adaptive_price
+
+
+def test_adaptive(pricing_setup):
+    vanilla, vanilla_dataset = pricing_setup(
+        {
+            "ticker": "SPX",
+            "ctr-type": "Vanilla Option",
+            "option_type": "Call",
+            "strike": 100,
+        }
+    )
+    knockout, knockout_dataset = pricing_setup(
+        {
+            "ticker": "SPX",
+            "ctr-type": "Knockout Option",
+            "option_type": "Call",
+            "strike": 100,
+            "barrier": 120,
+        }
+    )
+
+    # Without a tolerance, all the paths are run in one batch
+    px, stats = adaptive_price(CachedLVMC, vanilla, vanilla_dataset)
+    assert stats["PATHS"] == 10_000
+    assert 0 < stats["SE"] < 0.05 * px
+
+    # With a tolerance, the knockout needs more paths than the vanilla
+    for dataset in (vanilla_dataset, knockout_dataset):
+        dataset["MC"].update({"TOL": 0.01, "PATHS": 100_000})
+    px_vanilla, stats_vanilla = adaptive_price(
+        CachedLVMC, vanilla, vanilla_dataset
+    )
+    px_knockout, stats_knockout = adaptive_price(
+        CachedLVMC, knockout, knockout_dataset
+    )
+    assert stats_vanilla["SE"] <= 0.01 * px_vanilla
+    assert stats_knockout["SE"] <= 0.01 * px_knockout
+    assert stats_vanilla["PATHS"] < stats_knockout["PATHS"] < 100_000
+    assert px_vanilla == pytest.approx(px, abs=3 * stats["SE"])
+
+
+if __name__ == "__main__":
+    pytest.main()
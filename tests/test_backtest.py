@@ -2,8 +2,19 @@
 Script to test the plots in the backtest page without launching the app.
 """
 
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
 import pytest
-from demo.src.backtest import run_backtest
+from qablet.base.cf import CFModelPyBase
+
+from demo.src.backtest import run_backtest, stream_backtest
+from demo.src.cache import DiskCache
+from demo.src.model import CFModelPyCSV, DataModel
+from demo.src.payloads import _tables, get_trial, put_payload
+from demo.src.spots import SPOTS_FILE
+from demo.src.timetables import create_timetable
 
 
 def test_backtest():
@@ -19,5 +30,113 @@ def test_backtest():
     assert df["irr"].mean() == pytest.approx(0.0832365500, rel=1e-6)
 
 
+def test_parallel_backtest():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Discount Certificate",
+        "strike": 90,
+    }
+    # Bypass the result cache, which ignores the number of workers
+    df, stats = run_backtest.__wrapped__(contract_params, workers=1)
+    df_par, stats_par = run_backtest.__wrapped__(contract_params, workers=2)
+
+    # The parallel run matches the serial run exactly
+    assert df_par.equals(df)
+    assert stats_par == stats
+
+
+def test_stream_backtest():
+    contract_params = {
+        "ticker": "EUR",
+        "ctr-type": "Reverse Convertible",
+    }
+    df, stats = run_backtest(contract_params, annualized=False)
+
+    # The streamed results are those of run_backtest, in order of trade date
+    seen, priced = [], []
+    stream = stream_backtest(
+        contract_params, annualized=False, on_priced=priced.append
+    )
+    for i, result in enumerate(stream):
+        seen.append(result["date"])
+        assert result["irr"] == df["irr"][i]
+        assert result["price_se"] == df["price_se"][i]
+        assert result["ts"].tolist() == stats["stats"][i][0]
+        assert result["cf"].tolist() == stats["stats"][i][1]
+        assert result["price"] == stats["stats"][i][2]
+        assert result["dates"] == stats["ts"][i]
+    assert seen == df["date"].tolist()
+
+    # Each trial is reported as it is priced, before its batch is solved
+    assert priced == list(range(1, len(df) + 1))
+
+
+def test_payload(tmp_path, monkeypatch):
+    # A payload cache of the test, cleared below
+    payloads = DiskCache(str(tmp_path), suffix=".arrow")
+    monkeypatch.setattr("demo.src.payloads.PAYLOAD_CACHE", payloads)
+    contract_params = {
+        "ticker": "EUR",
+        "ctr-type": "Reverse Convertible",
+    }
+    _, stats = run_backtest(contract_params, annualized=False)
+    key = put_payload(stats)
+    assert len(key) == 32
+
+    # Read back from disk, as another worker would
+    _tables.clear()
+    for idx in [0, 17, len(stats["stats"]) - 1]:
+        dates, cf, ticker = get_trial(key, idx)
+        assert dates == stats["ts"][idx]
+        assert cf == stats["stats"][idx]
+        assert ticker == "EUR"
+
+    assert get_trial("../" + key, 0) is None
+    payloads.clear()
+    _tables.clear()
+    assert get_trial(key, 0) is None
+
+
+def test_batch_lookup():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Knockout Option",
+        "option_type": "Call",
+    }
+    csvdata = DataModel()
+    monthend_datetimes = csvdata.monthend_datetimes("SPX")
+    spot = csvdata.get_value("SPX", monthend_datetimes[0])
+    timetable = create_timetable(
+        monthend_datetimes, spot, 0, contract_params
+    ).timetable()
+
+    bk_model = CFModelPyCSV(filename=SPOTS_FILE, base="USD")
+    ts = csvdata.schedule_ts("SPX")
+    values = bk_model.get_values(["SPX", "EUR"], ts)
+    assert values.shape == (2, len(ts))
+    assert values[0, 5] == bk_model.get_value("SPX", int(ts[5]))
+    assert values[1, 7] == bk_model.get_value("EUR", int(ts[7]))
+
+    # The replay with prefetched fixings matches the scalar lookups
+    stats = bk_model.cashflow(timetable)
+    assert bk_model.fixings
+    bk_model.fixings = {}
+    expected = CFModelPyBase.cashflow(bk_model, timetable)
+    assert np.array_equal(stats["value"], expected["value"])
+
+
+def test_missing_fixing():
+    # SPX has no fixing on 2020-01-01 (a holiday), EUR has one
+    bk_model = CFModelPyCSV(filename=SPOTS_FILE, base="USD")
+    ts = int(datetime(2020, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+    assert bk_model.get_value("SPX", ts) is None
+    events = pa.table(
+        {"unit": ["SPX", "EUR"], "time": pa.array([ts, ts], pa.int64())}
+    )
+    bk_model.prefetch({"events": events})
+    assert bk_model.get_value("SPX", ts) is None
+    assert bk_model.get_value("EUR", ts) == bk_model.fixings[("EUR", ts)]
+
+
 if __name__ == "__main__":
     pytest.main()
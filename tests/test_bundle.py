@@ -0,0 +1,108 @@
+"""
+Script to test the bundle of precomputed results without launching the app.
+"""
+
+import pickle
+
+import pyarrow.parquet as pq
+import pytest
+from demo.src.backtest import run_backtest
+from demo.src.bundle import contract_grid, precompute, write_bundle
+from demo.src.cache import RESULT_CACHE, ResultBundle, ResultCache, cached
+from demo.src.timetables import contract_terms
+
+
+def test_contract_grid():
+    # The editor stores only the terms used by the contract type
+    params = contract_terms(
+        {
+            "ticker": "SPX",
+            "ctr-type": "Cliquet",
+            "option_type": "Call",
+            "strike": 100,
+            "floor_cap": [-5, 4.9],
+        }
+    )
+    assert params == {
+        "ticker": "SPX",
+        "ctr-type": "Cliquet",
+        "floor_cap": [-5.0, 4.9],
+    }
+
+    # 41 strikes, for each option type of the options, and 231 floor/caps
+    grid = contract_grid(["SPX"])
+    assert len(grid) == 41 * 2 + 41 * 2 * 2 + 231
+    assert params not in grid  # between the 1% steps, computed when viewed
+    assert contract_terms({**params, "floor_cap": [-5, 5]}) in grid
+    assert all(contract_terms(p) == p for p in grid)
+
+
+def test_bundle(tmp_path):
+    path = str(tmp_path / "bundle.parquet")
+    contracts = [
+        {"ticker": "SPX", "ctr-type": "Reverse Convertible", "strike": 80},
+        {"ticker": "SPX", "ctr-type": "Cliquet", "floor_cap": [-5.0, 5.0]},
+    ]
+    misses = RESULT_CACHE.stats()["misses"]
+    rows = [row for p in contracts for row in precompute(p)]
+    write_bundle(rows, path)
+    assert pq.ParquetFile(path).metadata.num_rows == 6
+    assert RESULT_CACHE.stats()["misses"] == misses  # the cache is not used
+
+    # The results are looked up by the keys of the cached functions
+    bundle = ResultBundle(path)
+    params = contracts[0]
+    df, stats = bundle.get(run_backtest.key(params, annualized=True))
+    expected_df, expected_stats = run_backtest(params, annualized=True)
+    assert df.equals(expected_df)
+    assert stats == expected_stats
+    assert bundle.get(run_backtest.key(params, annualized=False)) is None
+
+    # A cached function serves the bundle before it computes
+    calls = []
+    path = str(tmp_path / "compute.parquet")
+
+    compute_bundle = ResultBundle(path)
+
+    @cached(ResultCache(str(tmp_path / "results")), bundle=compute_bundle)
+    def compute(x):
+        calls.append(x)
+        return x
+
+    write_bundle([(compute.key(1), "compute", "{}", pickle.dumps(42))], path)
+    assert compute(1) == 42
+    assert compute(2) == 2
+    assert calls == [2]
+
+    # A result read from the bundle is then served from memory
+    assert compute(1) == 42
+    assert compute_bundle.hits == 1
+    assert compute.cache.stats()["memory_hits"] == 1
+
+    # The bundle is used without the result cache, and has its own switch
+    compute.cache.enabled = False
+    assert compute(1) == 42
+    assert calls == [2]
+    compute_bundle.enabled = False
+    assert compute(1) == 1
+    assert calls == [2, 1]
+
+
+def test_stale_bundle(tmp_path, monkeypatch):
+    path = str(tmp_path / "bundle.parquet")
+    write_bundle([("key", "compute", "{}", pickle.dumps(42))], path)
+    assert ResultBundle(path).get("key") == 42
+
+    # A bundle of another version of the code holds no results
+    monkeypatch.setattr("demo.src.cache.BUNDLE_VERSION", 0)
+    assert ResultBundle(path).get("key") is None
+    assert ResultBundle(str(tmp_path / "missing.parquet")).get("key") is None
+
+    # A corrupt bundle too
+    with open(path, "wb") as f:
+        f.write(b"PAR1 not a parquet file PAR1")
+    assert ResultBundle(path).get("key") is None
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,49 @@
+"""
+Script to test the result cache without launching the app.
+"""
+
+import pytest
+from demo.src.cache import ResultCache, cached
+
+
+def test_result_cache(tmp_path):
+    cache = ResultCache(str(tmp_path), max_entries=2)
+    calls = []
+
+    @cached(cache, ignore=("workers",))
+    def compute(params: dict, workers=1):
+        calls.append(params)
+        return {"strike": params["strike"], "cfs": [1.0, 2.0]}
+
+    result = compute({"ticker": "SPX", "strike": 100})
+    assert len(calls) == 1
+
+    # The key is canonical: it ignores dict order and the ignored arguments
+    result["cfs"].append(3.0)
+    again = compute({"strike": 100, "ticker": "SPX"}, workers=4)
+    assert len(calls) == 1
+    assert again == {"strike": 100, "cfs": [1.0, 2.0]}  # a fresh copy
+
+    # After the memory level is cleared, the value comes from disk
+    cache.memory.clear()
+    compute({"ticker": "SPX", "strike": 100})
+    assert len(calls) == 1
+    assert cache.stats()["memory_hits"] == 1
+    assert cache.stats()["disk_hits"] == 1
+
+    # Different parameters are a miss, and the LRU evicts beyond two entries
+    compute({"ticker": "SPX", "strike": 90})
+    compute({"ticker": "SPX", "strike": 80})
+    assert len(calls) == 3
+    assert cache.stats()["misses"] == 3
+    assert cache.stats()["memory_evictions"] == 1
+
+    # The disk cache evicts the least recently used files beyond its size
+    cache.disk.max_bytes = 1
+    compute({"ticker": "SPX", "strike": 70})
+    assert len(list(tmp_path.iterdir())) == 0
+    assert cache.stats()["disk_evictions"] == 4
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -3,7 +3,8 @@ Script to test the plots in the future page without launching the app.
 """
 
 import pytest
-from demo.src.future_cf import model_cashflows
+from demo.src.context import pricing_context
+from demo.src.future_cf import model_cashflows, vol_risk, vol_scenarios
 
 
 def test_future_cf():
@@ -19,5 +20,53 @@ def test_future_cf():
     assert len(spot_cfs) == 100
 
 
+def test_vol_scenarios():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+    }
+    scenarios = vol_scenarios(contract_params)
+
+    assert scenarios["spot"] == pytest.approx(3230.78, rel=1e-6)
+    assert (scenarios["vols"], scenarios["prices"]) == vol_risk(
+        contract_params
+    )
+
+    # Each scenario has the cashflows of model_cashflows at its vol
+    idx = scenarios["vols"].index(0.2)
+    contract_cfs, spot_cfs = scenarios["cashflows"][idx]
+    (model_cfs, model_spot_cfs), _ = model_cashflows(contract_params, vol=0.2)
+    assert contract_cfs == pytest.approx(model_cfs, rel=1e-5)
+    assert spot_cfs == pytest.approx(model_spot_cfs, rel=1e-5)
+
+
+def test_pricing_context():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+    }
+    ctx = pricing_context(contract_params)
+    assert ctx is pricing_context(dict(reversed(contract_params.items())))
+    assert ctx.spot == pytest.approx(3230.78, rel=1e-6)
+
+    # The forward timetable has one more event, the timetable is not changed
+    num_events = ctx.timetable()["events"].num_rows
+    assert ctx.timetable(forward=True)["events"].num_rows == num_events + 1
+    assert ctx.timetable()["events"].num_rows == num_events
+
+    # Each dataset is new
+    dataset = ctx.dataset(0.2)
+    dataset["MC"]["PATHS"] = 100
+    assert ctx.dataset()["MC"]["PATHS"] != 100
+    assert "VOL" not in ctx.dataset()["LV"]
+
+    # The assets are shared, read-only, so no dataset can change the others
+    dataset["ASSETS"]["SPX"] = None
+    assert ctx.dataset()["ASSETS"]["SPX"] is not None
+    _, forwards = ctx.dataset()["ASSETS"]["SPX"]
+    with pytest.raises(ValueError):
+        forwards[0, 1] *= 1.01
+
+
 if __name__ == "__main__":
     pytest.main()
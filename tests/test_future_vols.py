@@ -3,7 +3,14 @@ Script to test the vol risk in the future page without launching the app.
 """
 
 import pytest
-from demo.src.future_cf import vol_risk
+from demo.src.context import pricing_context
+from demo.src.future_cf import (
+    model_cashflows,
+    price_ladder,
+    vol_risk,
+    vol_scenarios,
+)
+from demo.src.mc import vol_ladder
 
 
 def test_vols():
@@ -18,5 +25,68 @@ def test_vols():
     assert move == pytest.approx(-5.1480718, rel=1e-6)
 
 
+def test_vol_grid():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+    }
+    _, prices = vol_risk(contract_params)
+
+    # A user supplied grid, each vol is priced with the same paths
+    vols, grid_prices = vol_risk(contract_params, vols=[0.3, 0.25, 0.02])
+    assert vols == [0.3, 0.25, 0.02]
+    assert grid_prices[0] == pytest.approx(prices[-1], rel=1e-12)
+    assert grid_prices[2] == pytest.approx(prices[0], rel=1e-12)
+    assert prices[-1] < grid_prices[1] < prices[-2]
+
+
+def test_coarse_ladder():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+    }
+    _, prices = vol_risk(contract_params)
+
+    coarse = []
+    ladder = price_ladder.__wrapped__(
+        contract_params, coarse_paths=1000, progress=coarse.append
+    )
+
+    # One coarse estimate, with fewer paths and wider errors, then all the paths
+    assert len(coarse) == 1
+    assert coarse[0]["paths"] == 1000
+    assert ladder["paths"] == 10_000
+    assert all(a > b for a, b in zip(coarse[0]["se"], ladder["se"]))
+
+    # The coarse estimate is a run of 1000 paths, that the refinement adds to
+    ctx = pricing_context(contract_params)
+    dataset = ctx.dataset()
+    dataset["MC"]["PATHS"] = 1000
+    coarse_prices, _ = vol_ladder(ctx.timetable(), dataset, ladder["vols"])
+    assert coarse[0]["prices"] == pytest.approx(coarse_prices, rel=1e-12)
+
+    # The refined prices agree with a single run of all the paths
+    for px, px_all, se in zip(ladder["prices"], prices, ladder["se"]):
+        assert px == pytest.approx(px_all, abs=4 * se + 1e-9)
+
+
+@pytest.mark.parametrize("sampling", ["PSEUDO", "SOBOL"])
+def test_cashflow_paths(sampling, monkeypatch):
+    # A Sobol run is in batches, the cashflows are those of all the batches
+    monkeypatch.setattr("demo.src.utils.MC_SAMPLING", sampling)
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+    }
+    sums, _ = model_cashflows.__wrapped__(contract_params)
+    assert [len(s) for s in sums] == [100, 100]
+
+    vols = [0.1, 0.2, 0.3]
+    scenarios = vol_scenarios.__wrapped__(contract_params, vols=vols)
+    for cashflows in scenarios["cashflows"]:
+        assert [len(c) for c in cashflows] == [100, 100]
+    assert len(scenarios["cashflows"]) == len(vols)
+
+
 if __name__ == "__main__":
     pytest.main()
@@ -0,0 +1,52 @@
+"""
+Script to test the greeks without launching the app.
+"""
+
+import numpy as np
+import pytest
+from scipy.stats import norm
+
+from demo.src.greeks import greeks
+from demo.src.model import DataModel
+
+
+def test_greeks():
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Vanilla Option",
+        "option_type": "Call",
+        "strike": 100,
+    }
+    df = greeks(contract_params, trials=(0, 1))
+    assert len(df) == 2
+
+    # Black-Scholes greeks of the at the money call, one year, flat 30% vol
+    csvdata = DataModel()
+    monthend_datetimes = csvdata.monthend_datetimes("SPX")
+    spot = csvdata.get_value("SPX", monthend_datetimes[0])
+    vol, r, q = 0.3, 0.03, 0.02
+    t = (monthend_datetimes[12] - monthend_datetimes[0]).days / 365
+    d1 = (r - q + vol**2 / 2) * t / (vol * np.sqrt(t))
+    d2 = d1 - vol * np.sqrt(t)
+    delta = np.exp(-q * t) * norm.cdf(d1)
+    gamma = np.exp(-q * t) * norm.pdf(d1) / (spot * vol * np.sqrt(t))
+    vega = spot * np.exp(-q * t) * norm.pdf(d1) * np.sqrt(t) / 100
+    theta = (
+        -spot * np.exp(-q * t) * norm.pdf(d1) * vol / (2 * np.sqrt(t))
+        - r * spot * np.exp(-r * t) * norm.cdf(d2)
+        + q * spot * np.exp(-q * t) * norm.cdf(d1)
+    ) / 365  # per day
+
+    row = df.iloc[0]
+    assert row["delta"] == pytest.approx(delta, abs=0.01)
+    assert row["vega"] == pytest.approx(vega, rel=0.02)
+    assert row["gamma"] == pytest.approx(gamma, rel=0.03)
+    assert row["theta"] == pytest.approx(theta, rel=0.03)
+
+    # The scenarios of a trial revalued in parallel give the same greeks
+    parallel = greeks.__wrapped__(contract_params, trials=(0,), workers=2)
+    assert parallel.equals(df.iloc[:1])
+
+
+if __name__ == "__main__":
+    pytest.main()
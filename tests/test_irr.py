@@ -0,0 +1,34 @@
+"""
+Script to test the batched irr solver without launching the app.
+"""
+
+import numpy as np
+import pytest
+from demo.src.utils import compute_return, compute_returns
+
+
+def test_irr():
+    # Ragged cashflows: a zero coupon, a coupon bond, and a total loss
+    payments = [
+        np.array([100 * np.exp(0.05)]),
+        np.array([5.0, 5.0, 105.0]),
+        np.array([0.0, 0.0]),
+    ]
+    times = [np.array([1.0]), np.array([1.0, 2.0, 3.0]), np.array([0.5, 1.0])]
+    prices = [100.0, 100.0, 10.0]
+
+    irrs, converged = compute_returns(payments, times, prices)
+
+    assert irrs[0] == pytest.approx(0.05, abs=1e-12)
+    pv = np.dot(payments[1], np.exp(-irrs[1] * times[1]))
+    assert pv == pytest.approx(100.0, abs=1e-9)
+    # No return can explain a total loss, which is reported, not hidden
+    assert list(converged) == [True, True, False]
+    assert np.isnan(irrs[2])
+
+    assert compute_return(payments[0], times[0], 100.0) == irrs[0]
+    assert compute_return(payments[2], times[2], 10.0) is None
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,154 @@
+"""
+Script to test the background jobs of the app without launching the app.
+"""
+
+import os
+import time
+
+import pytest
+from dash.exceptions import PreventUpdate
+
+from demo.src import jobs
+from demo.src.backtest import run_backtest
+from demo.src.jobs import JobManager, stop_if_superseded
+
+
+def wait_result(manager, key, pid, timeout=120):
+    """Wait for the result of a job, and return it with the progress seen."""
+    progress = []
+    start = time.time()
+    while not manager.result_ready(key):
+        assert time.time() - start < timeout
+        value = manager.get_progress(key)
+        if value is not None:
+            progress.append(value)
+        time.sleep(0.1)
+    return manager.get_result(key, pid), progress
+
+
+def test_jobs(tmp_path):
+    import app  # noqa: F401, registers the callbacks
+
+    manager = JobManager(directory=str(tmp_path), standby=0)
+    job_fns = {fn.__name__: job_fn for fn, job_fn in manager.jobs.values()}
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Vanilla Option",
+        "option_type": "Call",
+        "strike": 100,
+        "floor_cap": [-5, 5],
+    }
+
+    # Run the backtest callback in a job process
+    job_fn = job_fns["update_past_irr"]
+    pid = manager.call_job_fn("past", job_fn, [contract_params], {})
+    assert manager.job_running(pid)
+    result, progress = wait_result(manager, "past", pid)
+    fig, past_data, _ = result
+    assert len(fig["data"][0]["x"]) > 0
+    assert "key" in past_data
+    assert all("trade dates" in value[0] for value in progress)
+    assert not manager.result_ready("past")
+
+    # Cancel a job, as the cancel button does
+    job_fn = job_fns["update_future_vol"]
+    pid = manager.call_job_fn("future", job_fn, [contract_params], {})
+    manager.terminate_job(pid)
+    assert not manager.job_running(pid)
+    time.sleep(0.5)
+    assert not manager.result_ready("future")
+
+    # A new job of the callback from the same page supersedes the running one
+    context = {"args": {"endId": "page-1"}}
+    old_pid = manager.call_job_fn("old", job_fn, [contract_params], context)
+    pid = manager.call_job_fn("new", job_fn, [contract_params], context)
+    assert not manager.job_running(old_pid)
+    result, _ = wait_result(manager, "new", pid)
+    assert result[1]["params"] == contract_params
+    # killed, or stopped by itself without updating the outputs
+    assert manager.get_result("old", None) in (
+        manager.UNDEFINED,
+        {"_dash_no_update": "_dash_no_update"},
+    )
+
+
+def test_stop_if_superseded(tmp_path, monkeypatch):
+    manager = JobManager(directory=str(tmp_path), standby=0)
+    latest_key = manager.latest_key("fn", {"args": {"endId": "page-1"}})
+    stop_if_superseded()  # outside of a job
+
+    # The job stops once a newer job has claimed the latest slot
+    monkeypatch.setattr(jobs, "_current_job", (manager, "job", latest_key))
+    manager.handle.set(latest_key, (os.getpid(), None))
+    stop_if_superseded()
+    manager.handle.set(latest_key, (os.getpid() + 1, None))
+    with pytest.raises(PreventUpdate):
+        stop_if_superseded()
+
+
+def test_dash_api(tmp_path):
+    # The keys of the progress and set_props of a job, that the jobs rely on
+    manager = JobManager(directory=str(tmp_path), standby=0)
+    message = "dash changed the keys of a job, see demo.src.jobs"
+    assert hasattr(manager, "_make_progress_key"), message
+    assert hasattr(manager, "_make_set_props_key"), message
+    manager.handle.set(manager._make_progress_key("job"), ["Priced"])
+    assert manager.get_progress("job") == ["Priced"], message
+    manager.handle.set(manager._make_set_props_key("job"), {"plot": {}})
+    assert manager.get_updated_props("job") == {"plot": {}}, message
+
+
+def test_signing_secret(tmp_path):
+    # The secret is shared by the web workers, and kept out of the evicted results
+    directory = str(tmp_path / "jobs")
+    secret = JobManager(
+        directory=directory, standby=0
+    ).get_or_create_signing_secret(lambda: b"first")
+    other = JobManager(directory=directory, standby=0)
+    assert other.get_or_create_signing_secret(lambda: b"second") == secret
+    assert (tmp_path / "jobs.secret").read_bytes() == b"first"
+
+
+def test_partial_plots(tmp_path, monkeypatch):
+    import app  # noqa: F401, registers the callbacks
+
+    manager = JobManager(directory=str(tmp_path), standby=0)
+    update_past_irr = next(
+        fn
+        for fn, _ in manager.jobs.values()
+        if fn.__name__ == "update_past_irr"
+    )
+
+    # Plot at each trade date (not from the cache), recording the partial plots
+    figures = []
+    page = update_past_irr.__globals__
+    monkeypatch.setitem(page, "PARTIAL_PLOT_SECONDS", 0.0)
+    monkeypatch.setitem(page, "run_backtest", run_backtest.__wrapped__)
+    monkeypatch.setitem(
+        page, "set_props", lambda _id, props: figures.append(props["figure"])
+    )
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Reverse Convertible",
+        "strike": 80,
+    }
+    fig, _, _ = update_past_irr(lambda _: None, contract_params)
+
+    # A figure of the first points, then the new points as patches
+    x = list(figures[0]["data"][0]["x"])
+    histogram_y = list(figures[0]["data"][1]["y"])
+    for patch in figures[1:]:
+        for op in patch.to_plotly_json()["operations"]:
+            assert op["operation"] == "Extend"
+            if op["location"] == ["data", 0, "x"]:
+                x.extend(op["params"]["value"])
+            if op["location"] == ["data", 1, "y"]:
+                histogram_y.extend(op["params"]["value"])
+    # the points of the last batch are in the final figure only
+    assert len(figures) > 1
+    assert len(x) == len(histogram_y) < len(fig["data"][0]["x"])
+    assert histogram_y == list(fig["data"][1]["y"])[: len(x)]
+
+
+if __name__ == "__main__":
+    pytest.main()
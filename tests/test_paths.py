@@ -0,0 +1,41 @@
+"""
+Script to test the simulated path store without launching the app.
+"""
+
+import pytest
+from qablet.base.mc import MCPricer
+
+from demo.src.mc import PATH_STORE, CachedLVMC, SampledLVMC
+
+
+def test_path_store(pricing_setup):
+    def price(contract_params, state_class=CachedLVMC):
+        timetable, dataset = pricing_setup(contract_params, vol=0.2)
+        px, _ = MCPricer(state_class).price(timetable, dataset)
+        return px
+
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Vanilla Option",
+        "option_type": "Call",
+        "strike": 100,
+    }
+    PATH_STORE.clear()
+    PATH_STORE.hits = PATH_STORE.misses = 0
+    px = price(contract_params)
+    steps = PATH_STORE.misses
+    assert steps > 0 and PATH_STORE.hits == 0
+
+    # A new strike reuses the stored paths, at every step
+    px_110 = price({**contract_params, "strike": 110})
+    assert PATH_STORE.hits == steps and PATH_STORE.misses == steps
+    assert px_110 < px
+
+    # The stored paths give the same price as the paths of SampledLVMC
+    assert price(contract_params) == px
+    assert PATH_STORE.hits == 2 * steps
+    assert price(contract_params, SampledLVMC) == px
+
+
+if __name__ == "__main__":
+    pytest.main()
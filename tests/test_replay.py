@@ -0,0 +1,87 @@
+"""
+Script to test the batched cashflow replay without launching the app.
+"""
+
+import numpy as np
+import pytest
+from demo.src.backtest import backtest_trial, run_backtest, trial_timetable
+from demo.src.model import CFModelPyCSV, get_cf, get_cfs
+from demo.src.replay import replay, stack_timetables
+from demo.src.spots import SPOTS_FILE
+
+
+@pytest.mark.parametrize(
+    "contract_params",
+    [
+        {"ctr-type": "Discount Certificate"},
+        {"ctr-type": "Reverse Convertible"},
+        {"ctr-type": "Knockout Option", "option_type": "Put", "strike": 90},
+        {"ctr-type": "Vanilla Option", "option_type": "Call", "strike": 110},
+        {"ctr-type": "Cliquet", "floor_cap": [-2, 1]},
+    ],
+)
+def test_replay(contract_params):
+    contract_params = {**contract_params, "ticker": "SPX"}
+    timetables = [
+        trial_timetable(contract_params, trial)[3] for trial in range(40)
+    ]
+    cashflows = replay(*stack_timetables(timetables))
+
+    # Cross check with the qablet cashflow model, one trial at a time
+    bk_model = CFModelPyCSV(filename=SPOTS_FILE, base="USD")
+    trials = cashflows["trial"].to_numpy()
+    for trial, timetable in enumerate(timetables):
+        stats = bk_model.cashflow(timetable)
+        rows = cashflows.filter(trials == trial)
+        assert rows["index"].to_pylist() == stats["index"].to_pylist()
+        assert rows["value"].to_numpy() == pytest.approx(
+            stats["value"].to_numpy(), rel=1e-12
+        )
+
+
+def test_backtest_replay():
+    contract_params = {
+        "ticker": "EUR",
+        "ctr-type": "Reverse Convertible",
+    }
+    _, stats = run_backtest(contract_params, annualized=False)
+    for trial in [0, 17, 40]:
+        _, _, cf_vec, ts_vec, px, _, _ = backtest_trial(contract_params, trial)
+        ts_list, cf_list, price = stats["stats"][trial]
+        assert ts_list == ts_vec.tolist()
+        assert np.array(cf_list) == pytest.approx(cf_vec, rel=1e-12)
+        assert price == px
+
+
+def test_get_cfs():
+    contract_params = {"ticker": "BTC", "ctr-type": "Discount Certificate"}
+    timetables = [
+        trial_timetable(contract_params, trial) for trial in range(40)
+    ]
+    events, expressions = stack_timetables([tt for *_, tt in timetables])
+    cashflows = replay(events, expressions)
+
+    pricing_ts = [pricing_ts for _, pricing_ts, _, _ in timetables]
+    event_offsets = np.cumsum(
+        [0] + [tt["events"].num_rows for *_, tt in timetables]
+    )
+    times = events["time"].cast("int64").to_numpy()
+    yrs, cfs, ts, offsets = get_cfs(
+        pricing_ts, times, event_offsets, cashflows
+    )
+
+    # Same as get_cf, one trial at a time
+    for trial, (_, _, _, timetable) in enumerate(timetables):
+        start, end = offsets[trial], offsets[trial + 1]
+        rows = np.searchsorted(
+            cashflows["trial"].to_numpy(), [trial, trial + 1]
+        )
+        stats = cashflows.slice(rows[0], rows[1] - rows[0])
+        yrs_vec, cf_vec, ts_vec = get_cf(pricing_ts[trial], timetable, stats)
+        assert ts[start:end].tolist() == ts_vec.tolist()
+        assert cfs[start:end] == pytest.approx(cf_vec, rel=1e-12)
+        assert yrs[start:end] == pytest.approx(yrs_vec, rel=1e-12)
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,64 @@
+"""
+Script to test the Sobol and antithetic sampling without launching the app.
+"""
+
+import numpy as np
+import pytest
+from demo.src.mc import SampledLVMC, adaptive_price, vol_ladder
+from demo.src.sampling import SobolSampler, brownian_bridge
+
+
+def test_brownian_bridge():
+    times = np.array([0.1, 0.25, 0.5, 1.0, 1.5])
+    z = np.random.default_rng(1).standard_normal((len(times), 100_000))
+    dw = brownian_bridge(times, z)
+
+    # independent increments, with variance dt
+    dt = np.diff(times, prepend=0.0)
+    assert np.var(dw, axis=1) == pytest.approx(dt, rel=0.02)
+    assert np.corrcoef(dw)[0, 1:] == pytest.approx(np.zeros(4), abs=0.02)
+    assert np.sum(dw, axis=0) == pytest.approx(np.sqrt(1.5) * z[0])
+
+
+def test_sobol(pricing_setup):
+    contract_params = {
+        "ticker": "SPX",
+        "ctr-type": "Vanilla Option",
+        "option_type": "Call",
+        "strike": 100,
+    }
+    timetable, dataset = pricing_setup(contract_params)
+    dataset["MC"]["PATHS"] = 200_000
+    px, stats = adaptive_price(SampledLVMC, timetable, dataset)
+
+    # A tenth of the paths is within the error of the pseudo random run
+    dataset["MC"].update({"PATHS": 1024, "SAMPLING": "SOBOL"})
+    px_sobol, stats_sobol = adaptive_price(SampledLVMC, timetable, dataset)
+    assert px_sobol == pytest.approx(px, abs=5 * stats["SE"])
+
+    # The error of the Sobol run is the spread of its scrambled batches, below the
+    # error of as many pseudo random paths, and consistent with the pseudo price
+    se_sobol = stats_sobol["SE"]
+    assert 0 < se_sobol < stats["SE"] * np.sqrt(200_000 / 1024)
+    assert px_sobol == pytest.approx(px, abs=4 * (se_sobol + stats["SE"]))
+
+    # With a tolerance, a Sobol run needs at least two batches for its error
+    tol_mc = {"PATHS": 100_000, "BATCH": 1024, "TOL": 0.1}
+    _, stats_tol = adaptive_price(
+        SampledLVMC, timetable, {**dataset, "MC": {**dataset["MC"], **tol_mc}}
+    )
+    assert stats_tol["PATHS"] == 2048
+    assert stats_tol["SE"] <= 0.1 * px_sobol
+
+    prices, _ = vol_ladder(timetable, dataset, [0.3, 0.2])
+    assert prices[0] == pytest.approx(px_sobol, rel=1e-12)
+    assert prices[1] < prices[0]
+
+    # The steps must be on the times of the sampler
+    sampler = SobolSampler([0.5, 1.0], 8, seed=1)
+    with pytest.raises(ValueError):
+        sampler.draw(0.25, np.empty(8))
+
+
+if __name__ == "__main__":
+    pytest.main()
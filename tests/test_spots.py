@@ -0,0 +1,76 @@
+"""
+Script to test the shared spot store without launching the app.
+"""
+
+import shutil
+from datetime import datetime, timezone
+
+import pytest
+from demo.src.model import MS_IN_DAY, CFModelPyCSV, DataModel
+from demo.src.spots import (
+    SPOTS_FILE,
+    cache_path,
+    fingerprint,
+    get_store,
+    load_spots,
+    read_cache,
+)
+
+
+def test_shared_store():
+    store = get_store()
+    csvdata = DataModel()
+    bk_model = CFModelPyCSV(filename=SPOTS_FILE, base="USD")
+
+    # Both models draw from the same data, which is read only once
+    assert csvdata.data is store.data
+    assert bk_model.data is store.data
+    assert get_store("./" + SPOTS_FILE) is store
+
+    assert store.data.item(0, "SPX") == pytest.approx(3230.78, rel=1e-6)
+
+
+def test_columnar_cache(tmp_path):
+    filename = str(tmp_path / "spots.csv")
+    shutil.copy(SPOTS_FILE, filename)
+
+    # The first load ingests the csv into the cache
+    store = load_spots(filename)
+    fp = fingerprint(filename)
+    assert store.fingerprint == fp
+    cached = read_cache(filename, fp)
+    assert cached.equals(store.data)
+    assert cached.schema == store.data.schema
+
+    # A changed csv invalidates the cache, and is re-ingested
+    with open(filename, "a") as f:
+        f.write("2024-05-01,5000.0,1.07,60000.0,8100.0\n")
+    assert read_cache(filename, fingerprint(filename)) is None
+    store = load_spots(filename)
+    assert store.data.height == cached.height + 1
+    assert read_cache(filename, fingerprint(filename)) is not None
+    assert cache_path(filename).endswith(".arrow")
+
+
+def test_calendar():
+    csvdata = DataModel()
+    monthend_datetimes = csvdata.monthend_datetimes("SPX")
+    assert len(monthend_datetimes) == 53
+    assert monthend_datetimes[0] == datetime(2019, 12, 31, tzinfo=timezone.utc)
+    # Month-ends on a weekend are adjusted to the previous trading date
+    assert monthend_datetimes[5] == datetime(2020, 5, 29, tzinfo=timezone.utc)
+
+    # The schedule is cached, and shared by all data models
+    ts = csvdata.schedule_ts("SPX")
+    assert ts is DataModel().schedule_ts("SPX")
+    assert ts[5] == monthend_datetimes[5].timestamp() * 1000
+
+    # Week-ends, and an arbitrary schedule
+    weekend_ts = csvdata.schedule_ts("SPX", "1w")
+    assert len(weekend_ts) == 226
+    asof_ts = csvdata.store.asof_ts("SPX", weekend_ts + MS_IN_DAY)
+    assert (asof_ts == weekend_ts).all()
+
+
+if __name__ == "__main__":
+    pytest.main()
@@ -0,0 +1,93 @@
+"""
+Script to test the batch of timetables without launching the app.
+"""
+
+import numpy as np
+import pytest
+
+from demo.src.model import DataModel
+from demo.src.timetables import (
+    CONTRACT_TYPES,
+    create_forward_timetable,
+    create_timetable,
+    create_timetables,
+    extend_timetable,
+)
+
+
+@pytest.mark.parametrize("contract_type", CONTRACT_TYPES)
+@pytest.mark.parametrize("ticker", ["SPX", "BTC"])
+def test_create_timetables(contract_type, ticker):
+    contract_params = {
+        "ticker": ticker,
+        "ctr-type": contract_type,
+        "option_type": "Put",
+    }
+    csvdata = DataModel()
+    monthend_datetimes = csvdata.monthend_datetimes(ticker)
+    trials = np.arange(len(monthend_datetimes) - 12)
+    spots = [csvdata.get_value(ticker, monthend_datetimes[i]) for i in trials]
+
+    batch = create_timetables(
+        monthend_datetimes, spots, trials, contract_params
+    )
+    assert len(batch) == len(trials)
+    table = batch.table()
+    assert table.num_rows == batch.events.num_rows
+    assert np.all(np.diff(table["trial"].to_numpy()) >= 0)
+
+    # Each slice has the same events as the timetable of the trial
+    for i, trial in enumerate(trials):
+        expected = create_timetable(
+            monthend_datetimes, spots[i], trial, contract_params
+        ).timetable()
+        events = batch.timetable(i)["events"]
+        assert events.schema.equals(expected["events"].schema)
+        for row, expected_row in zip(
+            events.to_pylist(), expected["events"].to_pylist()
+        ):
+            quantity = row.pop("quantity")
+            assert quantity == pytest.approx(
+                expected_row.pop("quantity"), rel=1e-12
+            )
+            assert row == expected_row
+        assert events.num_rows == expected["events"].num_rows
+        assert (
+            batch.timetable(i)["expressions"].keys()
+            == expected["expressions"].keys()
+        )
+
+
+def test_extend_timetable():
+    contract_params = {"ticker": "SPX", "ctr-type": "Reverse Convertible"}
+    csvdata = DataModel()
+    monthend_datetimes = csvdata.monthend_datetimes("SPX")
+    spot = csvdata.get_value("SPX", monthend_datetimes[0])
+    timetable = create_timetable(
+        monthend_datetimes, spot, 0, contract_params
+    ).timetable()
+    events = timetable["events"]
+
+    end_dt = events["time"][-1].as_py()
+    fwd_timetable = create_forward_timetable(end_dt, contract_params)
+    extend_timetable(timetable, fwd_timetable)
+    extended = timetable["events"]
+    assert extended.schema.equals(events.schema)
+    assert extended.to_pylist() == (
+        events.to_pylist() + fwd_timetable["events"].to_pylist()
+    )
+
+    # The new events must not be before the timetable
+    with pytest.raises(ValueError):
+        extend_timetable(timetable, {"events": events})
+
+    # Two empty timetables extend to an empty timetable
+    empty = events.slice(0, 0)
+    timetable = {"events": empty, "expressions": {}}
+    extend_timetable(timetable, {"events": empty})
+    assert timetable["events"].num_rows == 0
+    assert timetable["events"].schema.equals(events.schema)
+
+
+if __name__ == "__main__":
+    pytest.main()